@@ -0,0 +1,138 @@
+import os, json, time, math
+from celery.signals import task_prerun, task_postrun
+from celery.utils.time import rate
+from logger import logger
+from queues import get_queue_depth, QUEUE_CONCURRENCY, QUEUE_WORKERS
+from redis_client import redis_client
+
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "true").lower() == "true"
+# Per pool: most tasks waiting (queued or held by the fair scheduler) and the
+# longest estimated wait in seconds before new work is turned away
+ADMISSION_LIMITS = json.loads(
+    os.getenv("ADMISSION_LIMITS")
+    or '{"video": {"max_depth": 40, "max_wait": 7200},'
+    ' "content": {"max_depth": 1500, "max_wait": 3600}}'
+)
+# Low priority work is turned away once past this share of the limits
+ADMISSION_LOW_PRIORITY_SHARE = float(os.getenv("ADMISSION_LOW_PRIORITY_SHARE", 0.5))
+# Recent task durations kept for wait estimates, and the guess without any
+ADMISSION_DURATION_SAMPLES = int(os.getenv("ADMISSION_DURATION_SAMPLES", 50))
+ADMISSION_DEFAULT_DURATION = float(os.getenv("ADMISSION_DEFAULT_DURATION", 120))
+# Seconds a backlog reading is reused for, to keep broker calls off hot paths
+ADMISSION_BACKLOG_TTL = float(os.getenv("ADMISSION_BACKLOG_TTL", 5))
+ADMISSION_MIN_RETRY_AFTER = int(os.getenv("ADMISSION_MIN_RETRY_AFTER", 30))
+ADMISSION_MAX_RETRY_AFTER = int(os.getenv("ADMISSION_MAX_RETRY_AFTER", 60 * 60))
+
+PRIORITIES = ("low", "normal")
+
+
+class Overloaded(Exception):
+    def __init__(self, message, status, retry_after):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Turns work away while a fair scheduling pool is backed up.
+
+    A pool's backlog is the tasks waiting in its Celery queue plus those the
+    fair scheduler is still holding back. The estimated wait is that backlog
+    drained at the slower of the queue's worker slots (recent average task
+    duration) and the task's rate limit across workers. Low priority work
+    is refused with 429 once past ADMISSION_LOW_PRIORITY_SHARE of a limit,
+    and all work with 503 past the limit itself, both with a Retry-After for
+    when the backlog should drain. Only the existing backlog counts, so any
+    request, however large, is admitted into an idle pool.
+    """
+
+    def __init__(self, celery, fair_scheduler, tasks):
+        self.celery = celery
+        self.fair_scheduler = fair_scheduler
+        # Pool name -> task whose durations drive the wait estimate
+        self.tasks = tasks
+        self.backlogs = {}
+        self.started = {}
+        task_prerun.connect(self.on_task_prerun, weak=False)
+        task_postrun.connect(self.on_task_postrun, weak=False)
+
+    def check(self, pool, priority="normal", size=1):
+        """Raise Overloaded if `size` more tasks should not be admitted now."""
+        limits = ADMISSION_LIMITS.get(pool)
+        if not ADMISSION_ENABLED or not limits:
+            return
+
+        share = ADMISSION_LOW_PRIORITY_SHARE if priority == "low" else 1
+        max_depth = limits["max_depth"] * share
+        max_wait = limits["max_wait"] * share
+
+        depth = self.get_backlog(pool)
+        seconds_per_task = self.get_seconds_per_task(pool)
+        wait = depth * seconds_per_task
+        if depth <= max_depth and wait <= max_wait:
+            return
+
+        # Time until the backlog is back under both limits
+        drain = max((depth - max_depth) * seconds_per_task, wait - max_wait)
+        retry_after = min(
+            max(math.ceil(drain), ADMISSION_MIN_RETRY_AFTER),
+            ADMISSION_MAX_RETRY_AFTER,
+        )
+        logger.warning(
+            f"Refusing {size} {priority} priority {pool} tasks: "
+            f"{depth} waiting, ~{int(wait)}s estimated wait"
+        )
+        if priority == "low":
+            raise Overloaded(
+                "Busy, low priority work is deferred. Retry later.", 429, retry_after
+            )
+        raise Overloaded("Too much work queued. Retry later.", 503, retry_after)
+
+    def get_backlog(self, pool):
+        cached = self.backlogs.get(pool)
+        if cached and time.monotonic() - cached[0] < ADMISSION_BACKLOG_TTL:
+            return cached[1]
+
+        backlog = get_queue_depth(
+            self.celery, self.fair_scheduler.pools[pool]
+        ) + self.fair_scheduler.get_pending(pool)
+        self.backlogs[pool] = (time.monotonic(), backlog)
+        return backlog
+
+    def get_seconds_per_task(self, pool):
+        """Seconds between task completions once the pool is saturated."""
+        queue = self.fair_scheduler.pools[pool]
+        seconds = self.get_task_duration(pool) / QUEUE_CONCURRENCY.get(queue, 1)
+
+        # Celery rate limits apply per worker, whatever its concurrency
+        task = self.celery.tasks.get(self.tasks[pool])
+        per_second = rate(task.rate_limit) if task else 0
+        if per_second:
+            seconds = max(seconds, 1 / (per_second * QUEUE_WORKERS.get(queue, 1)))
+        return seconds
+
+    def get_task_duration(self, pool):
+        durations = redis_client.lrange(
+            f"admission:durations:{self.tasks[pool]}", 0, -1
+        )
+        if not durations:
+            return ADMISSION_DEFAULT_DURATION
+        return sum(float(d) for d in durations) / len(durations)
+
+    def on_task_prerun(self, task_id=None, task=None, **kwargs):
+        if task.name in self.tasks.values():
+            self.started[task_id] = time.monotonic()
+
+    def on_task_postrun(self, task_id=None, task=None, **kwargs):
+        started = self.started.pop(task_id, None)
+        if started is None:
+            return
+        key = f"admission:durations:{task.name}"
+        try:
+            pipe = redis_client.pipeline()
+            pipe.lpush(key, round(time.monotonic() - started, 3))
+            pipe.ltrim(key, 0, ADMISSION_DURATION_SAMPLES - 1)
+            pipe.execute()
+        except Exception as e:
+            logger.error(f"Failed to record duration of {task_id}: {e}")
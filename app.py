@@ -1,13 +1,15 @@
 import os, re, json
 from flask import Flask, request, jsonify, session, redirect, Response
 from pyairtable import Api, Table, Base
-from celery import Celery
+from celery import Celery, group
 from cryptography.fernet import Fernet
-from datetime import datetime, timedelta, timezone
+from concurrent.futures import ThreadPoolExecutor
 from metricool import (
     schedule_metricool_post,
     create_metricool_list_post,
     update_metricool_list_post,
+    build_scheduled_post_data,
+    METRICOOL_CONCURRENCY,
 )
 from gdrive import (
     upload_video_to_drive,
@@ -17,18 +19,35 @@ from transcription import transcribe_video
 from utils import (
     download_tmp_video,
     download_tmp_image,
+    download_image,
     midjourney_imagine,
     send_prompt_to_claude,
     edit_hook_to_image,
     upload_image,
     get_table_by_id,
+    get_records_by_ids,
     get_file_content,
+    crop_midjourney_grid,
+    fit_thumbnail,
+    encode_thumbnail,
+    MIDJOURNEY_LOCAL_CROP,
 )
 from logger import logger
-from youtube import flow
-from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload
+from scratch import workspace, SCRATCH_VIDEO_RESERVE_MB
+from dedup import get_idempotency_key, enqueue_once
+from replica import AirtableReplica
+from summarize import condense_transcript
+from media_cache import get_cached_media, cache_media
+from fairness import FairScheduler
+from admission import AdmissionController, Overloaded, PRIORITIES
+from redis_client import redis_client
+from checkpoints import get_checkpoint, save_checkpoint, clear_checkpoints, run_stage
+from jobs import get_job_status, save_job_details
+from queues import get_task_routes, HOUSEKEEPING_QUEUE
+from profiling import setup_profiling
+from capture import setup_capture, REPLAY_DIR, REPLAY_ENCRYPTION_KEY
+from youtube import flow, get_youtube_client
+from googleapiclient.http import MediaFileUpload, MediaIoBaseUpload
 from time import sleep
 
 # Initialize flask app
@@ -39,7 +58,11 @@ CLAUDE_MODEL = os.getenv("CLAUDE_MODEL")
 ANTHROPIC_API_KEY = os.getenv("ANTHROPIC_API_KEY")
 AIRTABLE_API_KEY = os.getenv("AIRTABLE_API_KEY")
 AIRTABLE_BASE_ID = os.getenv("AIRTABLE_BASE_ID")
-ENCRYPTION_KEY = os.getenv("ENCRYPTION_KEY")
+# Captured API keys are redacted, replay re-encrypts stand-ins with its own key
+ENCRYPTION_KEY = REPLAY_ENCRYPTION_KEY if REPLAY_DIR else os.getenv("ENCRYPTION_KEY")
+RECORD_ID = re.compile(r"^rec[A-Za-z0-9]{14}$")
+SUBMISSION_CACHE_TTL = int(os.getenv("SUBMISSION_CACHE_TTL", 60 * 60))
+GENERATE_BATCH_MAX_SUBMISSIONS = int(os.getenv("GENERATE_BATCH_MAX_SUBMISSIONS", 1000))
 
 
 # Celery configuration
@@ -50,6 +73,9 @@ app.config["CELERY_BROKER_URL"] = (
 app.config["result_backend"] = (
     os.getenv("CELERY_RESULT_BACKEND", REDIS_URL) or "redis://localhost:6379/"
 )
+app.config["result_expires"] = int(os.getenv("CELERY_RESULT_EXPIRES", 86400))
+app.config["task_routes"] = get_task_routes()
+app.config["task_default_queue"] = HOUSEKEEPING_QUEUE
 app.secret_key = "SECRETKEY"
 
 # Initialize Celery
@@ -65,8 +91,31 @@ if not app.debug:
     handler.setLevel(logging.ERROR)
     app.logger.addHandler(handler)
 
+# On-demand profiling of routes and tasks (PROFILE_* env vars, X-Profile header)
+setup_profiling(app)
+# Traffic capture for load testing, or replay of a capture (CAPTURE_*, REPLAY_*)
+setup_capture(app)
+
+# Per-tenant fair scheduling pools and the queues they feed
+task_routes = celery.conf.task_routes
+fair_scheduler = FairScheduler(
+    celery,
+    {
+        "video": task_routes["app.process_video_task"]["queue"],
+        "content": task_routes["app.generate_content_for_platform"]["queue"],
+    },
+)
+# Backlog-based admission control for the fair scheduling pools
+admission = AdmissionController(
+    celery,
+    fair_scheduler,
+    {"video": "app.process_video_task", "content": "app.generate_content_for_platform"},
+)
+
 # Initialize Airtable API
 api = Api(AIRTABLE_API_KEY)
+# Local read replica of the config tables (Users, Keys)
+replica = AirtableReplica(api, AIRTABLE_BASE_ID)
 
 
 def get_platform_strategy(platform_name, user_id):
@@ -88,9 +137,7 @@ def get_platform_prompt(platform_name, user_id):
 
 
 def get_user_record(user_id):
-    base = Base(api, AIRTABLE_BASE_ID)
-    table = Table(None, base, "Users")
-    return table.first(formula=f"{{UserID}} = '{user_id}'")
+    return replica.first("Users", "UserID", user_id)
 
 
 def update_response_table(platform_name, submission_id, response, user_id):
@@ -112,9 +159,7 @@ def update_response_table(platform_name, submission_id, response, user_id):
 )
 def generate_content_for_platform(platform, submission_id):
     sleep(20)
-    submission_record = get_table_by_id(
-        "Submissions", submission_id, api, AIRTABLE_BASE_ID
-    )
+    submission_record = get_submission_record(submission_id)
 
     user_id = submission_record["fields"].get("User", [None])[0]
 
@@ -139,31 +184,21 @@ def generate_content_for_platform(platform, submission_id):
         file_url = writing_style_file[0].get("url")
         prompt_data["WritingStyle"] = get_file_content(file_url)
 
-    prompt = prompt_template.format().format(**prompt_data)
     claude_model = (
         submission_record["fields"].get("Anthropic Model", CLAUDE_MODEL).strip()
     )
 
-    api_key = None
-    if user_id:
-        base = Base(api, AIRTABLE_BASE_ID)
-        keys_table = Table(None, base, "Keys")
-        records = keys_table.all(formula=f"{{Provider}} = 'Anthropic'")
-        encrypted_api_key = next(
-            (
-                rec["fields"].get("Key")
-                for rec in records
-                if rec["fields"].get("User") == [user_id]
-            ),
-            None,
-        )
-
-        if encrypted_api_key:
-            api_key = decrypt_key(encrypted_api_key)
-
+    api_key = get_user_api_key(user_id)
     if not api_key:
         raise Exception("No api key provided.")
 
+    prompt_data["Transcript"] = condense_transcript(
+        prompt_data["Transcript"],
+        claude_model,
+        api_key,
+        f"submission:{submission_id}",
+    )
+    prompt = prompt_template.format().format(**prompt_data)
     response = send_prompt_to_claude(prompt, claude_model, api_key)
     if response:
         user_id = submission_record["fields"].get("User", [None])[0]
@@ -173,11 +208,56 @@ def generate_content_for_platform(platform, submission_id):
         return f"Error generating content for {platform}"
 
 
+def get_encrypted_api_key(user_id):
+    if not user_id:
+        return None
+
+    for airtable in (False, True):
+        # Keys added since the last replica sync are only in Airtable
+        records = replica.all("Keys", "Provider", "Anthropic", airtable=airtable)
+        key = next(
+            (
+                rec["fields"].get("Key")
+                for rec in records
+                if rec["fields"].get("User") == [user_id]
+            ),
+            None,
+        )
+        if key:
+            return key
+    return None
+
+
+def get_user_api_key(user_id):
+    encrypted_api_key = get_encrypted_api_key(user_id)
+    if encrypted_api_key:
+        return decrypt_key(encrypted_api_key)
+    return None
+
+
+def get_submission_record(submission_id):
+    # Platform tasks share the record read when their generation was queued
+    cached = redis_client.get(f"submission:{submission_id}")
+    if cached:
+        return json.loads(cached)
+    return get_table_by_id("Submissions", submission_id, api, AIRTABLE_BASE_ID)
+
+
+def cache_submission_records(records):
+    pipe = redis_client.pipeline()
+    for record in records:
+        pipe.set(
+            f"submission:{record['id']}",
+            json.dumps(record),
+            ex=SUBMISSION_CACHE_TTL,
+        )
+    pipe.execute()
+
+
 @app.route("/generate-content", methods=["POST"])
 def generate_content_route():
     app.logger.info("Received generate-content request")
     data = request.get_json()
-    app.logger.info(f"Request data: {data}")
 
     submission_data = data.get("submission_id")
     app.logger.info(f"Submission data: {submission_data}")
@@ -191,19 +271,158 @@ def generate_content_route():
         app.logger.error("Invalid submission ID")
         return jsonify({"error": "Invalid submission ID."}), 400
 
-    platforms = os.getenv(
+    platforms = get_platforms()
+
+    key = get_idempotency_key(
+        "generate-content",
+        submission_id,
+        data,
+        request.headers.get("Idempotency-Key"),
+    )
+
+    def enqueue(job_id):
+        admission.check("content", get_priority(data), len(platforms))
+        # The submission is read by the task, and its group saved under job_id
+        queue_content_generation_task.apply_async(
+            args=(submission_id, platforms), task_id=job_id
+        )
+
+    job_id, duplicate = enqueue_job(key, enqueue)
+
+    app.logger.info("Content generation tasks queued")
+    return job_response("Content generation tasks queued.", job_id, duplicate)
+
+
+def get_platforms():
+    return os.getenv(
         "PLATFORMS",
         "LinkedIn Articles,Twitter,Facebook,Instagram,YouTube,Pinterest,Blogs",
     ).split(",")
-    for i, platform in enumerate(platforms):
-        app.logger.info(f"Generating content for platform: {platform}")
-        generate_content_for_platform.apply_async(
-            countdown=i * 10,
-            args=(platform, submission_id),
+
+
+def queue_content_generation(submission_records, platforms, job_id=None):
+    """Queue every platform for every submission as one saved group."""
+    cache_submission_records(submission_records)
+
+    tasks = []
+    tenants = []
+    for submission_record in submission_records:
+        tenant = submission_record["fields"].get("User", [None])[0]
+        for i, platform in enumerate(platforms):
+            app.logger.info(f"Generating content for platform: {platform}")
+            tasks.append(
+                generate_content_for_platform.signature(
+                    args=(platform, submission_record["id"]), countdown=i * 10
+                )
+            )
+            tenants.append(tenant)
+
+    content_group = group(tasks)
+    job = content_group.freeze(group_id=job_id)
+    job.save()
+    for task, tenant in zip(content_group.tasks, tenants):
+        fair_scheduler.submit(task, tenant, "content")
+    return job
+
+
+@celery.task
+def queue_content_generation_task(submission_id, platforms):
+    submission_record = get_table_by_id(
+        "Submissions", submission_id, api, AIRTABLE_BASE_ID
+    )
+    queue_content_generation(
+        [submission_record], platforms, queue_content_generation_task.request.id
+    )
+
+
+@celery.task
+def generate_content_batch_task(submission_ids, platforms):
+    submission_records = get_records_by_ids(
+        "Submissions", submission_ids, api, AIRTABLE_BASE_ID
+    )
+    found = {record["id"] for record in submission_records}
+    skipped = {
+        submission_id: "Submission not found."
+        for submission_id in submission_ids
+        if submission_id not in found
+    }
+
+    # Check each user's config once for all of their submissions
+    user_errors = {}
+    queued = []
+    for submission_record in submission_records:
+        user_id = submission_record["fields"].get("User", [None])[0]
+        if user_id not in user_errors:
+            user_errors[user_id] = get_user_config_error(user_id)
+
+        if user_errors[user_id]:
+            skipped[submission_record["id"]] = user_errors[user_id]
+        else:
+            queued.append(submission_record)
+
+    # The batch's own id becomes its group's, so the job tracks the content
+    job_id = generate_content_batch_task.request.id
+    save_job_details(
+        celery,
+        job_id,
+        {"queued": [record["id"] for record in queued], "skipped": skipped},
+    )
+    if queued:
+        queue_content_generation(queued, platforms, job_id)
+    logger.info(f"Queued content generation for {len(queued)} submissions")
+
+
+def get_user_config_error(user_id):
+    if not user_id:
+        return "Submission has no user."
+    if get_user_record(user_id) is None:
+        return "User not found."
+    if not get_encrypted_api_key(user_id):
+        return "No api key provided."
+    return None
+
+
+@app.route("/generate-content-batch", methods=["POST"])
+def generate_content_batch():
+    data = request.get_json()
+    submission_ids = data.get("submission_ids")
+
+    if not submission_ids:
+        return jsonify({"error": "Missing submission IDs."}), 400
+    if not isinstance(submission_ids, list):
+        return jsonify({"error": "submission_ids must be a list."}), 400
+    invalid_ids = [
+        submission_id
+        for submission_id in submission_ids
+        if not isinstance(submission_id, str) or not RECORD_ID.match(submission_id)
+    ]
+    if invalid_ids:
+        return (
+            jsonify({"error": "Invalid submission IDs.", "invalid": invalid_ids}),
+            400,
+        )
+    submission_ids = list(dict.fromkeys(submission_ids))
+    if len(submission_ids) > GENERATE_BATCH_MAX_SUBMISSIONS:
+        return (
+            jsonify(
+                {
+                    "error": "Too many submission IDs, the maximum is "
+                    f"{GENERATE_BATCH_MAX_SUBMISSIONS}."
+                }
+            ),
+            400,
         )
 
-    app.logger.info("Content generation tasks queued")
-    return jsonify({"message": "Content generation tasks queued."})
+    platforms = get_platforms()
+    # Bulk backfills give way to single submissions under load
+    admission.check(
+        "content", get_priority(data, "low"), len(submission_ids) * len(platforms)
+    )
+    job = generate_content_batch_task.apply_async(args=(submission_ids, platforms))
+    return (
+        jsonify({"message": "Batch content generation queued.", "job_id": job.id}),
+        202,
+    )
 
 
 def get_latest_submission(base_id):
@@ -213,11 +432,8 @@ def get_latest_submission(base_id):
     return records[0] if records else None
 
 
-@app.route("/split-out-tweets", methods=["POST"])
-def split_out_tweets():
-    data = request.get_json()
-    twitter_record_id = data.get("twitter_record_id")
-
+@celery.task
+def split_out_tweets_task(twitter_record_id):
     base = Base(api, AIRTABLE_BASE_ID)
     table = Table(None, base, "Twitter")
     record = table.get(twitter_record_id)
@@ -237,16 +453,29 @@ def split_out_tweets():
         }
         table.create(fields)
 
-    return jsonify({"message": "Split out tweets successfully"})
+    return f"Split out {len(tweets)} tweets successfully"
 
 
-@app.route("/encrypt_key", methods=["POST"])
-def encrypt_key():
+@app.route("/split-out-tweets", methods=["POST"])
+def split_out_tweets():
     data = request.get_json()
+    twitter_record_id = data.get("twitter_record_id")
 
-    cipher_suite = Fernet(ENCRYPTION_KEY)
-    api_key = data.get("apiKey")
-    encrypted_api_key = cipher_suite.encrypt(api_key.encode())
+    if not twitter_record_id:
+        return jsonify({"error": "Missing twitter record ID."}), 400
+
+    job = split_out_tweets_task.apply_async(args=(twitter_record_id,))
+    return jsonify({"message": "Split out tweets task queued.", "job_id": job.id}), 202
+
+
+@celery.task(
+    autoretry_for=(Exception,),
+    retry_backoff=True,
+    retry_kwargs={"max_retries": 5},
+)
+def encrypt_key_task(encrypted_api_key):
+    # Only the ciphertext travels through the broker
+    api_key = decrypt_key(encrypted_api_key)
 
     base = Base(api, AIRTABLE_BASE_ID)
     table = Table(None, base, "Keys")
@@ -254,9 +483,24 @@ def encrypt_key():
     # Update the key in Airtable
     record = table.first(formula=f"{{Key}} = '{api_key}'")
     if record:
-        table.update(record.get("id"), {"Key": encrypted_api_key.decode()})
+        replica.update("Keys", record.get("id"), {"Key": encrypted_api_key})
+
+    return "Key encrypted successfully."
+
+
+@app.route("/encrypt_key", methods=["POST"])
+def encrypt_key():
+    data = request.get_json()
+    api_key = data.get("apiKey")
 
-    return jsonify({"message": "Key encrypted successfully."})
+    if not api_key:
+        return jsonify({"error": "Missing api key."}), 400
+
+    cipher_suite = Fernet(ENCRYPTION_KEY)
+    encrypted_api_key = cipher_suite.encrypt(api_key.encode())
+
+    job = encrypt_key_task.apply_async(args=(encrypted_api_key.decode(),))
+    return jsonify({"message": "Key encryption task queued.", "job_id": job.id}), 202
 
 
 def decrypt_key(encrypted_key):
@@ -274,24 +518,7 @@ def schedule_post():
     post_text = data.get("text")
     media_urls = data.get("media_urls")
 
-    scheduled_post_data = {
-        "providers": [{"network": platform}],
-        "publicationDate": {
-            "dateTime": (datetime.now(timezone.utc) + timedelta(days=1)).strftime(
-                "%Y-%m-%dT%H:%M:%S"
-            ),
-            "timezone": "Australia/Adelaide",
-        },
-        "text": post_text,
-        "media": media_urls,
-        "autoPublish": True,
-        "shortener": True,
-        "descendants": [],
-    }
-
-    if platform == "pinterest":
-        scheduled_post_data["pinterestData"] = {"pinNewFormat": True}
-
+    scheduled_post_data = build_scheduled_post_data(platform, post_text, media_urls)
     response = schedule_metricool_post(blog_id, user_id, scheduled_post_data)
 
     if response.ok:
@@ -302,6 +529,35 @@ def schedule_post():
         return jsonify({"error": "Failed to create post."}), 400
 
 
+@celery.task
+def post_to_list_task(blog_id, user_id, list_id, post_text, media_urls):
+    add_post_to_list(blog_id, user_id, list_id, post_text, media_urls)
+    return "Post added to list successfully."
+
+
+def add_post_to_list(blog_id, user_id, list_id, post_text, media_urls):
+    response = create_metricool_list_post(blog_id, user_id, list_id)
+
+    uploaded_media_urls = []
+    with workspace("list_post", memory=True) as scratch_dir:
+        for media_url in media_urls or []:
+            image_path = download_tmp_image(media_url, blog_id, scratch_dir)
+            uploaded_media_urls.append(upload_image(image_path).get("secure_url"))
+
+    if response.status_code != 200:
+        logger.error("Failed to create list post, Status: %s", response.status_code)
+        logger.error("Error: %s", response.content)
+        raise Exception("Failed to create list post.")
+
+    create_post = response.json()[-1]
+    response = update_metricool_list_post(
+        blog_id, user_id, list_id, create_post["id"], post_text, uploaded_media_urls
+    )
+    if not response.ok:
+        logger.error("Failed to update list post.")
+        raise Exception("Failed to update list post.")
+
+
 @app.route("/post-to-list", methods=["POST"])
 def post_to_list():
     data = request.get_json()
@@ -314,35 +570,94 @@ def post_to_list():
     if not user_id or not list_id or not blog_id:
         return jsonify({"error": "Missing required parameters."}), 400
 
-    response = create_metricool_list_post(blog_id, user_id, list_id)
-
-    for media_url in media_urls:
-        image_path = download_tmp_image(media_url, blog_id)
-        updated_media_url = upload_image(image_path).get("secure_url")
-        media_urls.remove(media_url)
-        media_urls.append(updated_media_url)
-
-    if response.status_code != 200:
-        app.logger.error("Failed to create list post, Status: %s", response.status_code)
-        app.logger.error("Error: %s", response.content)
-        return jsonify({"error": "Failed to create list post."}), 400
-
-    create_post = response.json()[-1]
-    response = update_metricool_list_post(
-        blog_id, user_id, list_id, create_post["id"], post_text, media_urls
+    job = post_to_list_task.apply_async(
+        args=(blog_id, user_id, list_id, post_text, media_urls)
     )
-    if not response.ok:
-        app.logger.error("Failed to update list post.")
-        return jsonify({"error": "Failed to update list post."}), 400
+    return jsonify({"message": "Post to list task queued.", "job_id": job.id}), 202
+
+
+@celery.task
+def schedule_posts_task(posts):
+    # Posts for the same list run in order: Metricool returns the newly
+    # created list post as the last entry of the list
+    batches = {}
+    for index, post in enumerate(posts):
+        list_id = post.get("list_id")
+        key = (post.get("blog_id"), list_id) if list_id else index
+        batches.setdefault(key, []).append((index, post))
+
+    results = [None] * len(posts)
+
+    def run_batch(batch):
+        for index, post in batch:
+            results[index] = schedule_batch_post(index, post)
+
+    with ThreadPoolExecutor(max_workers=METRICOOL_CONCURRENCY) as executor:
+        list(executor.map(run_batch, batches.values()))
+
+    return results
+
+
+def schedule_batch_post(index, post):
+    blog_id = post.get("blog_id")
+    user_id = post.get("user_id")
+    list_id = post.get("list_id")
+    post_text = post.get("text")
+    media_urls = post.get("media_urls") or []
+
+    try:
+        if list_id:
+            add_post_to_list(blog_id, user_id, list_id, post_text, media_urls)
+        else:
+            platform = post.get("platform", "").lower()
+            scheduled_post_data = build_scheduled_post_data(
+                platform, post_text, media_urls
+            )
+            response = schedule_metricool_post(blog_id, user_id, scheduled_post_data)
+            if not response.ok:
+                logger.error("Response %s", response.content)
+                raise Exception(
+                    f"Failed to create post. Status: {response.status_code}"
+                )
+    except Exception as e:
+        logger.error(f"Failed to schedule post {index} for blog {blog_id}: {e}")
+        return {"index": index, "ok": False, "error": str(e)}
+
+    return {"index": index, "ok": True}
+
+
+@app.route("/schedule-posts", methods=["POST"])
+def schedule_posts():
+    data = request.get_json()
+    posts = data.get("posts")
+
+    if not posts or not isinstance(posts, list):
+        return jsonify({"error": "Missing posts."}), 400
+
+    invalid = [
+        index
+        for index, post in enumerate(posts)
+        if not isinstance(post, dict)
+        or not post.get("blog_id")
+        or not post.get("user_id")
+        or not (post.get("platform") or post.get("list_id"))
+    ]
+    if invalid:
+        return (
+            jsonify({"error": "Missing required parameters.", "invalid": invalid}),
+            400,
+        )
 
-    return jsonify({"message": "Post added to list successfully."})
+    job = schedule_posts_task.apply_async(args=(posts,))
+    return jsonify({"message": "Post scheduling task queued.", "job_id": job.id}), 202
 
 
 def update_airtable_table(table, record_id, data):
-    logger.info(f"Updating Airtable table {table} id {record_id} with data {data}")
-    base = Base(api, AIRTABLE_BASE_ID)
-    table = Table(None, base, "Videos")
-    table.update(record_id, data)
+    fields = ", ".join(
+        f"{name} ({len(str(value))} chars)" for name, value in data.items()
+    )
+    logger.info(f"Updating Airtable table {table} id {record_id}: {fields}")
+    replica.update(table, record_id, data)
 
 
 @celery.task(
@@ -352,22 +667,59 @@ def update_airtable_table(table, record_id, data):
     rate_limit="7/m",
 )
 def process_video_task(record_id, video_url, file_name, customer_name, user_name):
-    video_path = download_tmp_video(video_url, file_name)
-    gdrive_path = f"{customer_name}/{user_name}"
-    file_id = upload_video_to_drive(file_name, video_path, gdrive_path)
+    checkpoint_key = f"video:{record_id}"
+    if get_checkpoint(checkpoint_key, "video_url") != video_url:
+        clear_checkpoints(checkpoint_key)
+        save_checkpoint(checkpoint_key, "video_url", video_url)
+
+    file_id = get_checkpoint(checkpoint_key, "drive_file_id")
+    transcription = get_checkpoint(checkpoint_key, "transcription")
+
+    if file_id is None or transcription is None:
+        with workspace("video", reserve_mb=SCRATCH_VIDEO_RESERVE_MB) as scratch_dir:
+            if file_id is None:
+                video_path = get_cached_media(video_url, scratch_dir)
+                if video_path is None:
+                    video_path = download_tmp_video(video_url, file_name, scratch_dir)
+                gdrive_path = f"{customer_name}/{user_name}"
+                file_id = upload_video_to_drive(file_name, video_path, gdrive_path)
+                save_checkpoint(checkpoint_key, "drive_file_id", file_id)
+                logger.info(f"Uploaded video to drive: {file_id}")
+            else:
+                # The source attachment is cleared once the video is on Drive
+                video_path = get_cached_media(file_id, scratch_dir)
+                if video_path is None:
+                    video_path = download_file_from_drive(file_id, scratch_dir)
+
+            # Kept for /upload-to-youtube landing on this node
+            cache_media(video_path, [file_id, video_url])
+
+            update_data = {
+                "Video File": None,
+                "Storage Link": f"https://drive.google.com/open?id={file_id}",
+            }
+            run_stage(
+                checkpoint_key,
+                "storage_link_saved",
+                update_airtable_table,
+                "Videos",
+                record_id,
+                update_data,
+            )
+
+            transcription = transcribe_video(video_path, checkpoint_key)
+            save_checkpoint(checkpoint_key, "transcription", transcription)
 
-    update_data = {
-        "Video File": None,
-        "Storage Link": f"https://drive.google.com/open?id={file_id}",
-    }
-    update_airtable_table("Videos", record_id, update_data)
-    logger.info(f"Uploaded video to drive: {file_id}")
-
-    transcription = transcribe_video(video_path)
     update_data = {"Transcription": transcription}
-    update_airtable_table("Videos", record_id, update_data)
+    run_stage(
+        checkpoint_key,
+        "transcription_saved",
+        update_airtable_table,
+        "Videos",
+        record_id,
+        update_data,
+    )
     logger.info(f"Transcribed video and saved to Airtable")
-    os.unlink(video_path)
 
     video_record = get_table_by_id("Videos", record_id, api, AIRTABLE_BASE_ID)
     user_id = video_record["fields"]["User"][0]
@@ -377,15 +729,40 @@ def process_video_task(record_id, video_url, file_name, customer_name, user_name
     desc_prompt = user["fields"].get("Video Description Prompt")
     hook_prompt = user["fields"].get("Video Hook Prompt")
 
-    title_prompt = title_prompt.format().format(Transcription=transcription)
-    desc_prompt = desc_prompt.format().format(Transcription=transcription)
-    hook_prompt = hook_prompt.format().format(Transcription=transcription)
-
-    title = send_prompt_to_claude(title_prompt, CLAUDE_MODEL, ANTHROPIC_API_KEY)
+    # Prompts get a condensed brief of long transcripts, Airtable the full text
+    brief = condense_transcript(
+        transcription, CLAUDE_MODEL, ANTHROPIC_API_KEY, f"video:{record_id}"
+    )
+    title_prompt = title_prompt.format().format(Transcription=brief)
+    desc_prompt = desc_prompt.format().format(Transcription=brief)
+    hook_prompt = hook_prompt.format().format(Transcription=brief)
+
+    title = run_stage(
+        checkpoint_key,
+        "title",
+        send_prompt_to_claude,
+        title_prompt,
+        CLAUDE_MODEL,
+        ANTHROPIC_API_KEY,
+    )
     sleep(5)
-    description = send_prompt_to_claude(desc_prompt, CLAUDE_MODEL, ANTHROPIC_API_KEY)
+    description = run_stage(
+        checkpoint_key,
+        "description",
+        send_prompt_to_claude,
+        desc_prompt,
+        CLAUDE_MODEL,
+        ANTHROPIC_API_KEY,
+    )
     sleep(5)
-    hook = send_prompt_to_claude(hook_prompt, CLAUDE_MODEL, ANTHROPIC_API_KEY)
+    hook = run_stage(
+        checkpoint_key,
+        "hook",
+        send_prompt_to_claude,
+        hook_prompt,
+        CLAUDE_MODEL,
+        ANTHROPIC_API_KEY,
+    )
 
     # update airtable
     update_data = {
@@ -393,26 +770,71 @@ def process_video_task(record_id, video_url, file_name, customer_name, user_name
         "Video Description": description,
         "Video Hook": hook,
     }
-    update_airtable_table("Videos", record_id, update_data)
+    run_stage(
+        checkpoint_key,
+        "text_saved",
+        update_airtable_table,
+        "Videos",
+        record_id,
+        update_data,
+    )
     logger.info("Updated 'Videos' table with Title, Description & Hook")
 
     prompt = f'Write a very detailed prompt for Midjourney to generate 16:9 aspect ratio thumbnail images for youtube video with title "{title}" and description "{description}", Your response should only include the prompt, without any additional information, just raw text no commands or tweaks'
-    mj_prompt = send_prompt_to_claude(prompt, CLAUDE_MODEL, ANTHROPIC_API_KEY)
-
-    img_url = midjourney_imagine(mj_prompt)
-    img_path = download_tmp_image(img_url, hook[:10])
-    edit_hook_to_image(hook, img_path)
-    edited_img_url = upload_image(img_path).get("secure_url")
+    mj_prompt = run_stage(
+        checkpoint_key,
+        "mj_prompt",
+        send_prompt_to_claude,
+        prompt,
+        CLAUDE_MODEL,
+        ANTHROPIC_API_KEY,
+    )
 
-    update_data = {"Thumbnail Image": [{"url": edited_img_url}]}
-    update_airtable_table("Videos", record_id, update_data)
+    if MIDJOURNEY_LOCAL_CROP:
+        grid_url = run_stage(
+            checkpoint_key, "grid_url", midjourney_imagine, mj_prompt, upscale=False
+        )
+        thumbnail_urls = run_stage(
+            checkpoint_key, "thumbnail_urls", create_grid_thumbnails, grid_url, hook
+        )
+    else:
+        img_url = run_stage(checkpoint_key, "image_url", midjourney_imagine, mj_prompt)
+        thumbnail_urls = [
+            run_stage(checkpoint_key, "thumbnail_url", create_thumbnail, img_url, hook)
+        ]
+
+    update_data = {"Thumbnail Image": [{"url": url} for url in thumbnail_urls]}
+    run_stage(
+        checkpoint_key,
+        "thumbnail_saved",
+        update_airtable_table,
+        "Videos",
+        record_id,
+        update_data,
+    )
     logger.info("Updated 'Videos' table with Thumbnail image")
 
     update_data = {"Status": "Ready for Review"}
     update_airtable_table("Videos", record_id, update_data)
+    clear_checkpoints(checkpoint_key)
     logger.info("Completed processing video")
 
 
+def create_thumbnail(img_url, hook):
+    # Kept in memory from download to upload
+    img = fit_thumbnail(download_image(img_url))
+    img = edit_hook_to_image(hook, img)
+    return upload_image(encode_thumbnail(img)).get("secure_url")
+
+
+def create_grid_thumbnails(grid_url, hook):
+    thumbnail_urls = []
+    for img in crop_midjourney_grid(download_image(grid_url)):
+        img = edit_hook_to_image(hook, fit_thumbnail(img))
+        thumbnail_urls.append(upload_image(encode_thumbnail(img)).get("secure_url"))
+    return thumbnail_urls
+
+
 @app.route("/process-video", methods=["POST"])
 def process_video():
     data = request.get_json()
@@ -422,10 +844,24 @@ def process_video():
     user_name = data.get("user_name")
     record_id = data.get("record_id")
 
-    process_video_task.apply_async(
-        args=(record_id, video_url, video_filename, customer_name, user_name)
+    key = get_idempotency_key(
+        "process-video", record_id, data, request.headers.get("Idempotency-Key")
     )
-    return jsonify({"message": "Video processing task queued."})
+
+    def enqueue(job_id):
+        admission.check("video", get_priority(data))
+        fair_scheduler.submit(
+            process_video_task.signature(
+                args=(record_id, video_url, video_filename, customer_name, user_name),
+                task_id=job_id,
+            ),
+            f"{customer_name}/{user_name}",
+            "video",
+            dispatch=False,
+        )
+
+    job_id, duplicate = enqueue_job(key, enqueue)
+    return job_response("Video processing task queued.", job_id, duplicate)
 
 
 @app.route("/authorize-youtube", methods=["GET"])
@@ -467,65 +903,127 @@ def oauth2callback():
     return Response(oauth_success_page, mimetype="text/html")
 
 
-@app.route("/upload-to-youtube", methods=["POST"])
-def upload_to_youtube():
-    data = request.get_json()
-    video_record_id = data.get("video_record_id")
-    user_record_id = data.get("user_record_id")
-
-    base = Base(api, AIRTABLE_BASE_ID)
-
-    table = Table(None, base, "Users")
-    user_record = table.get(user_record_id)
+@celery.task
+def upload_to_youtube_task(video_record_id, user_record_id):
+    user_record = replica.get("Users", user_record_id)
     token_json_str = user_record["fields"].get("Youtube Credential")
-    token_json = json.loads(token_json_str)
-
-    credentials = Credentials.from_authorized_user_info(
-        token_json, scopes=["https://www.googleapis.com/auth/youtube.upload"]
+    youtube = get_youtube_client(
+        user_record_id,
+        token_json_str,
+        on_refresh=lambda token: update_airtable_table(
+            "Users", user_record_id, {"Youtube Credential": token}
+        ),
     )
-    youtube = build("youtube", "v3", credentials=credentials)
 
     video_record = get_table_by_id("Videos", video_record_id, api, AIRTABLE_BASE_ID)
     title = video_record["fields"].get("Video Title")
     description = video_record["fields"].get("Video Description")
     google_drive_url = video_record["fields"].get("Storage Link")
     thumbnail_url = video_record["fields"].get("Thumbnail Image")[0].get("url")
-    thumbnail = download_tmp_image(thumbnail_url, title[:10])
-
-    file_id = re.search(r"open\?id=([^\&]+)", google_drive_url).group(1)
-    video_path = download_file_from_drive(file_id)
-
-    response = (
-        youtube.videos()
-        .insert(
-            part="snippet,status",
-            body={
-                "snippet": {
-                    "categoryId": "22",
-                    "description": description,
-                    "title": title,
-                    "defaultLanguage": "en",
-                    "defaultAudioLanguage": "en",
+    # YouTube takes JPEG (not WEBP) thumbnails under 2 MB
+    thumbnail = encode_thumbnail(download_image(thumbnail_url), format="JPEG")
+    with workspace("youtube", reserve_mb=SCRATCH_VIDEO_RESERVE_MB) as scratch_dir:
+
+        file_id = re.search(r"open\?id=([^\&]+)", google_drive_url).group(1)
+        video_path = get_cached_media(file_id, scratch_dir)
+        if video_path is None:
+            video_path = download_file_from_drive(file_id, scratch_dir)
+            cache_media(video_path, [file_id])
+
+        response = (
+            youtube.videos()
+            .insert(
+                part="snippet,status",
+                body={
+                    "snippet": {
+                        "categoryId": "22",
+                        "description": description,
+                        "title": title,
+                        "defaultLanguage": "en",
+                        "defaultAudioLanguage": "en",
+                    },
+                    "status": {"privacyStatus": "public"},
                 },
-                "status": {"privacyStatus": "public"},
-            },
-            media_body=MediaFileUpload(video_path),
+                media_body=MediaFileUpload(video_path),
+            )
+            .execute()
         )
-        .execute()
-    )
 
-    # set thumbnail
-    youtube.thumbnails().set(
-        videoId=response["id"],
-        media_body=thumbnail,
-    )
+        # set thumbnail
+        youtube.thumbnails().set(
+            videoId=response["id"],
+            media_body=MediaIoBaseUpload(thumbnail, mimetype="image/jpeg"),
+        ).execute()
     update_airtable_table(
         "Videos",
         video_record_id,
         {"Youtube Link": f"https://www.youtube.com/watch?v={response['id']}"},
     )
     logger.info(f"Uploaded video to youtube.")
-    return "Video uploaded successfully!"
+    return f"https://www.youtube.com/watch?v={response['id']}"
+
+
+@app.route("/upload-to-youtube", methods=["POST"])
+def upload_to_youtube():
+    data = request.get_json()
+    video_record_id = data.get("video_record_id")
+    user_record_id = data.get("user_record_id")
+
+    if not video_record_id or not user_record_id:
+        return jsonify({"error": "Missing required parameters."}), 400
+
+    job = upload_to_youtube_task.apply_async(args=(video_record_id, user_record_id))
+    return jsonify({"message": "YouTube upload task queued.", "job_id": job.id}), 202
+
+
+def job_is_reusable(job_id):
+    return get_job_status(celery, job_id)["state"] != "FAILURE"
+
+
+def enqueue_job(key, enqueue):
+    """enqueue_once, failing the pre-assigned job if enqueueing fails."""
+
+    def run(job_id):
+        try:
+            enqueue(job_id)
+        except Exception as e:
+            # Duplicates may already have been handed this job id
+            celery.backend.mark_as_failure(job_id, e)
+            raise
+
+    return enqueue_once(key, run, is_reusable=job_is_reusable)
+
+
+def job_response(message, job_id, duplicate=False):
+    if duplicate:
+        return (
+            jsonify(
+                {
+                    "message": "Duplicate request, returning the existing job.",
+                    "job_id": job_id,
+                    "duplicate": True,
+                }
+            ),
+            200,
+        )
+    return jsonify({"message": message, "job_id": job_id}), 202
+
+
+def get_priority(data, default="normal"):
+    priority = request.headers.get("X-Priority") or data.get("priority") or default
+    return priority if priority in PRIORITIES else default
+
+
+@app.errorhandler(Overloaded)
+def overloaded(e):
+    response = jsonify({"error": str(e), "retry_after": e.retry_after})
+    response.headers["Retry-After"] = str(e.retry_after)
+    return response, e.status
+
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def job_status(job_id):
+    return jsonify(get_job_status(celery, job_id))
 
 
 if __name__ == "__main__":
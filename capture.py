@@ -0,0 +1,353 @@
+import os, re, glob, json, time, random, hashlib, threading, itertools
+from collections import defaultdict, deque
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+import requests
+from cryptography.fernet import Fernet
+from requests.structures import CaseInsensitiveDict
+from flask import g, request
+from logger import logger
+
+# Record incoming POST payloads and outgoing `requests` traffic to CAPTURE_DIR
+CAPTURE_ENABLED = os.getenv("CAPTURE_ENABLED", "false").lower() == "true"
+CAPTURE_DIR = os.getenv("CAPTURE_DIR", "captures")
+CAPTURE_SESSION = os.getenv("CAPTURE_SESSION") or time.strftime("%Y%m%d")
+# Fraction of incoming requests captured
+CAPTURE_RATE = float(os.getenv("CAPTURE_RATE", 1.0))
+# Binary response bodies up to this size are kept, bigger ones only by size
+CAPTURE_MAX_BINARY_BYTES = int(os.getenv("CAPTURE_MAX_BINARY_BYTES", 0))
+# Strings longer than this (or with whitespace) are replaced by filler of the
+# same length; shorter ones are kept as ids and option values
+CAPTURE_MAX_TEXT = int(os.getenv("CAPTURE_MAX_TEXT", 64))
+
+# Serve outgoing `requests` calls from a captured session instead
+REPLAY_DIR = os.getenv("REPLAY_DIR")
+# Recorded external latencies are divided by this during replay
+REPLAY_SPEED = float(os.getenv("REPLAY_SPEED", 1))
+# Served for downloads captured only by size, so media processing can run
+REPLAY_MEDIA_FILE = os.getenv("REPLAY_MEDIA_FILE")
+# Length of the fake Whisper transcript returned per audio chunk
+REPLAY_TRANSCRIPT_CHARS = int(os.getenv("REPLAY_TRANSCRIPT_CHARS", 20000))
+# Replay only: redacted API keys are re-encrypted with this fixed key, which
+# the app uses instead of ENCRYPTION_KEY
+REPLAY_ENCRYPTION_KEY = "cmVwbGF5LW9ubHktbm90LWEtc2VjcmV0LWtleS0wMDA="
+REPLAY_API_KEY = "replay-api-key"
+
+SENSITIVE = re.compile(
+    r"key|token|secret|password|authorization|credential|cookie|email|code|state",
+    re.I,
+)
+# Fields holding names and free text, masked whatever their length
+PERSONAL = re.compile(
+    r"name|title|description|text|transcript|prompt|style|topic|hook|content",
+    re.I,
+)
+LOCAL_HOSTS = ("localhost", "127.0.0.1", "::1")
+CAPTURED_HEADERS = ("Content-Type", "Idempotency-Key", "X-Priority")
+
+_send = requests.Session.send
+_write_lock = threading.Lock()
+
+
+def sanitize(value, key=""):
+    """Mask secrets and personal text while keeping payload shapes and sizes."""
+    if SENSITIVE.search(key):
+        return "REDACTED"
+    if isinstance(value, dict):
+        return {k: sanitize(v, k) for k, v in value.items()}
+    if isinstance(value, list):
+        return [sanitize(v, key) for v in value]
+    if isinstance(value, str) and value.startswith(("http://", "https://")):
+        # Kept so replayed downloads match their captured responses
+        return sanitize_url(value)
+    if isinstance(value, str) and (
+        PERSONAL.search(key) or len(value) > CAPTURE_MAX_TEXT or re.search(r"\s", value)
+    ):
+        return "x" * len(value)
+    return value
+
+
+def digest(text):
+    # Already sanitized URLs pass through unchanged, so replays match captures
+    if text.startswith("h-"):
+        return text
+    return "h-" + hashlib.sha256(text.encode()).hexdigest()[:16]
+
+
+def sanitize_url(url):
+    """Keep the host, hash the path and query values (names, signed links)."""
+    parts = urlsplit(url)
+    path = parts.path.lstrip("/")
+    query = [
+        (k, "REDACTED" if SENSITIVE.search(k) else digest(v))
+        for k, v in parse_qsl(parts.query, keep_blank_values=True)
+    ]
+    return urlunsplit(
+        parts._replace(path=f"/{digest(path)}" if path else "", query=urlencode(query))
+    )
+
+
+def write_record(kind, record):
+    path = os.path.join(CAPTURE_DIR, CAPTURE_SESSION, f"{kind}-{os.getpid()}.jsonl")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with _write_lock, open(path, "a") as f:
+        f.write(json.dumps(record, default=str) + "\n")
+
+
+def capture_body(response, stream):
+    content_type = response.headers.get("Content-Type", "")
+    if stream:
+        # Reading a streamed download here would load it all into memory
+        return {"size": int(response.headers.get("Content-Length") or 0)}
+    if "json" in content_type:
+        try:
+            return {"json": sanitize(response.json())}
+        except ValueError:
+            pass
+    if content_type.startswith("text/"):
+        return {"text": sanitize(response.text)}
+    size = len(response.content)
+    if size <= CAPTURE_MAX_BINARY_BYTES:
+        return {"hex": response.content.hex()}
+    return {"size": size}
+
+
+def capturing_send(session, prepared, **kwargs):
+    started = time.time()
+    response = _send(session, prepared, **kwargs)
+    if urlsplit(prepared.url).hostname in LOCAL_HOSTS:
+        return response
+    try:
+        write_record(
+            "responses",
+            {
+                "t": started,
+                "method": prepared.method,
+                "url": sanitize_url(prepared.url),
+                "status": response.status_code,
+                "headers": {
+                    k: v
+                    for k, v in response.headers.items()
+                    if k in ("Content-Type", "Retry-After")
+                },
+                "elapsed": response.elapsed.total_seconds(),
+                "body": capture_body(response, kwargs.get("stream", False)),
+            },
+        )
+    except Exception as e:
+        logger.error(f"Failed to capture response from {prepared.url}: {e}")
+    return response
+
+
+def get_replay_media(size):
+    if REPLAY_MEDIA_FILE:
+        with open(REPLAY_MEDIA_FILE, "rb") as f:
+            return f.read()
+    return b"\0" * size
+
+
+def restore_redacted(value, key=""):
+    """Put usable stand-ins back for redacted Airtable secrets."""
+    if value == "REDACTED" and key == "Key":
+        return Fernet(REPLAY_ENCRYPTION_KEY).encrypt(REPLAY_API_KEY.encode()).decode()
+    if value == "REDACTED" and key == "Youtube Credential":
+        # Far off expiry, so the client never tries to refresh it
+        return json.dumps(
+            {
+                "token": "replay",
+                "expiry": "2100-01-01T00:00:00Z",
+                "refresh_token": "replay",
+                "client_id": "replay",
+                "client_secret": "replay",
+            }
+        )
+    if isinstance(value, dict):
+        return {k: restore_redacted(v, k) for k, v in value.items()}
+    if isinstance(value, list):
+        return [restore_redacted(v, key) for v in value]
+    return value
+
+
+class FakeTransport:
+    """
+    Answers `requests` calls from captured responses.
+
+    Responses are matched on method and sanitized URL, falling back to
+    method and path (Airtable formulas embed timestamps), and served in
+    recorded order, repeating the last one once a match runs out.
+    """
+
+    def __init__(self, directory):
+        self.by_url = defaultdict(deque)
+        self.by_path = defaultdict(deque)
+        self.lock = threading.Lock()
+
+        records = []
+        for path in glob.glob(os.path.join(directory, "responses-*.jsonl")):
+            with open(path) as f:
+                records.extend(json.loads(line) for line in f if line.strip())
+        for record in sorted(records, key=lambda r: r["t"]):
+            self.by_url[(record["method"], record["url"])].append(record)
+            self.by_path[(record["method"], self.get_path(record["url"]))].append(
+                record
+            )
+        logger.info(f"Replaying {len(records)} captured responses from {directory}")
+
+    def get_path(self, url):
+        parts = urlsplit(url)
+        return f"{parts.netloc}{parts.path}"
+
+    def next_record(self, method, url):
+        with self.lock:
+            url = sanitize_url(url)
+            for records in (
+                self.by_url.get((method, url)),
+                self.by_path.get((method, self.get_path(url))),
+            ):
+                if records:
+                    return records.popleft() if len(records) > 1 else records[0]
+        return None
+
+    def send(self, session, prepared, **kwargs):
+        # Local services (and the replay driver itself) are reached for real
+        if urlsplit(prepared.url).hostname in LOCAL_HOSTS:
+            return _send(session, prepared, **kwargs)
+
+        record = self.next_record(prepared.method, prepared.url)
+        response = requests.Response()
+        response.url = prepared.url
+        response.request = prepared
+        response.encoding = "utf-8"
+
+        if record is None:
+            logger.warning(f"No captured response for {prepared.method} {prepared.url}")
+            response.status_code = 404
+            response.headers = CaseInsensitiveDict({"Content-Type": "application/json"})
+            response._content = b'{"error": "Not captured"}'
+            response._content_consumed = True
+            return response
+
+        time.sleep(record["elapsed"] / REPLAY_SPEED)
+        body = record["body"]
+        if "json" in body:
+            content = json.dumps(restore_redacted(body["json"])).encode()
+        elif "text" in body:
+            content = body["text"].encode()
+        elif "hex" in body:
+            content = bytes.fromhex(body["hex"])
+        else:
+            content = get_replay_media(body["size"])
+
+        response.status_code = record["status"]
+        response.headers = CaseInsensitiveDict(record["headers"])
+        response.headers["Content-Length"] = str(len(content))
+        response._content = content
+        response._content_consumed = True
+        return response
+
+
+_replay_ids = itertools.count(1)
+
+
+def install_replay_fakes():
+    """
+    Answer the clients that bypass `requests` locally: Drive, YouTube and
+    Google tokens (httplib2), Whisper (httpx, via OpenAI) and Cloudinary.
+
+    Google downloads get REPLAY_MEDIA_FILE, resumable uploads a session URI
+    and every other call one JSON body with the fields the app reads.
+    """
+    # Imported here as only replay needs them
+    import httpx, httplib2, cloudinary.uploader, gdrive
+    from google.auth.credentials import AnonymousCredentials
+
+    httplib2_request = httplib2.Http.request
+    httpx_send = httpx.Client.send
+
+    def google_request(http, uri, method="GET", body=None, headers=None, **kwargs):
+        if urlsplit(uri).hostname in LOCAL_HOSTS:
+            return httplib2_request(http, uri, method, body, headers, **kwargs)
+
+        info = {"status": "200", "content-type": "application/json"}
+        if "alt=media" in uri:
+            content = get_replay_media(0)
+            info["content-type"] = "application/octet-stream"
+        elif "uploadType=resumable" in uri and method == "POST":
+            content = b""
+            info["location"] = f"{uri}&upload_id=replay"
+        else:
+            content = json.dumps(
+                {
+                    "id": f"replay-{next(_replay_ids)}",
+                    "name": "replay.mp4",
+                    "files": [],
+                    "access_token": "replay",
+                    "token_type": "Bearer",
+                    "expires_in": 3600,
+                }
+            ).encode()
+        info["content-length"] = str(len(content))
+        return httplib2.Response(info), content
+
+    def whisper_send(client, request, **kwargs):
+        if request.url.host in LOCAL_HOSTS:
+            return httpx_send(client, request, **kwargs)
+        return httpx.Response(
+            200,
+            headers={"Content-Type": "text/plain"},
+            text="x" * REPLAY_TRANSCRIPT_CHARS,
+            request=request,
+        )
+
+    def cloudinary_upload(file, **options):
+        public_id = f"replay-{next(_replay_ids)}"
+        url = f"https://res.cloudinary.com/replay/image/upload/{public_id}.jpg"
+        return {"public_id": public_id, "url": url, "secure_url": url}
+
+    httplib2.Http.request = google_request
+    httpx.Client.send = whisper_send
+    cloudinary.uploader.upload = cloudinary_upload
+    # No service account key is needed when Google is never reached
+    gdrive.authenticate = AnonymousCredentials
+    os.environ.setdefault("OPENAI_API_KEY", "replay")
+
+
+def setup_capture(app):
+    """Capture webhooks and external responses, or replay them, per env vars."""
+    if REPLAY_DIR:
+        transport = FakeTransport(REPLAY_DIR)
+        requests.Session.send = lambda session, prepared, **kwargs: transport.send(
+            session, prepared, **kwargs
+        )
+        install_replay_fakes()
+        return
+
+    if not CAPTURE_ENABLED:
+        return
+
+    requests.Session.send = capturing_send
+
+    @app.before_request
+    def start_request_capture():
+        g.capture = request.method == "POST" and random.random() < CAPTURE_RATE
+        g.capture_started = time.time()
+
+    @app.after_request
+    def capture_request(response):
+        if g.get("capture"):
+            write_record(
+                "requests",
+                {
+                    "t": g.capture_started,
+                    "method": request.method,
+                    "path": request.path,
+                    "headers": {
+                        k: v
+                        for k, v in request.headers.items()
+                        if k in CAPTURED_HEADERS
+                    },
+                    "json": sanitize(request.get_json(silent=True)),
+                    "status": response.status_code,
+                    "latency": time.time() - g.capture_started,
+                },
+            )
+        return response
@@ -0,0 +1,44 @@
+import os, json
+from logger import logger, log_stage
+from redis_client import redis_client
+
+CHECKPOINT_TTL = int(os.getenv("CHECKPOINT_TTL", 7 * 24 * 60 * 60))
+
+
+def get_checkpoint_key(key):
+    return f"checkpoint:{key}"
+
+
+def has_checkpoint(key, stage):
+    return redis_client.hexists(get_checkpoint_key(key), stage)
+
+
+def get_checkpoint(key, stage, default=None):
+    value = redis_client.hget(get_checkpoint_key(key), stage)
+    if value is None:
+        return default
+    return json.loads(value)
+
+
+def save_checkpoint(key, stage, value):
+    checkpoint_key = get_checkpoint_key(key)
+    pipe = redis_client.pipeline()
+    pipe.hset(checkpoint_key, stage, json.dumps(value))
+    pipe.expire(checkpoint_key, CHECKPOINT_TTL)
+    pipe.execute()
+
+
+def clear_checkpoints(key):
+    redis_client.delete(get_checkpoint_key(key))
+
+
+def run_stage(key, stage, func, *args, **kwargs):
+    """Run `func` once per checkpoint key; retries reuse the stored result."""
+    if has_checkpoint(key, stage):
+        logger.info(f"Skipping completed stage {stage} for {key}")
+        return get_checkpoint(key, stage)
+
+    with log_stage(stage):
+        value = func(*args, **kwargs)
+    save_checkpoint(key, stage, value)
+    return value
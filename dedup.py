@@ -0,0 +1,65 @@
+import os, json, hashlib
+from celery.utils import uuid
+from logger import logger
+from redis_client import redis_client
+
+DEDUP_WINDOW = int(os.getenv("DEDUP_WINDOW", 10 * 60))
+
+# Swap a key's value only if it still holds the expected one
+COMPARE_AND_SET = redis_client.register_script("""
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    redis.call("set", KEYS[1], ARGV[2], "EX", ARGV[3])
+    return 1
+end
+return 0
+""")
+COMPARE_AND_DELETE = redis_client.register_script("""
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+""")
+
+
+def get_idempotency_key(scope, record_id, payload, idempotency_key=None):
+    if idempotency_key:
+        return f"idempotency:{scope}:{idempotency_key}"
+
+    digest = hashlib.sha256(
+        json.dumps(payload, sort_keys=True, default=str).encode()
+    ).hexdigest()
+    return f"idempotency:{scope}:{record_id}:{digest}"
+
+
+def enqueue_once(key, enqueue, is_reusable=lambda job_id: True):
+    """
+    Enqueue work at most once per key within DEDUP_WINDOW.
+
+    Returns (job_id, duplicate). The job id is assigned and stored before
+    `enqueue(job_id)` runs, and `enqueue` must create the job under that id,
+    so a duplicate arriving mid-enqueue still gets the job id. An existing
+    job is only reused while `is_reusable(job_id)` holds, so failed jobs can
+    be triggered again.
+    """
+    job_id = uuid()
+    while True:
+        if redis_client.set(key, job_id, nx=True, ex=DEDUP_WINDOW):
+            break
+
+        existing = redis_client.get(key)
+        if existing is None:
+            continue
+        if is_reusable(existing):
+            logger.info(f"Duplicate request for {key}, returning job {existing}")
+            return existing, True
+        # Replace the failed job, unless a concurrent request already did
+        if COMPARE_AND_SET(keys=[key], args=[existing, job_id, DEDUP_WINDOW]):
+            break
+
+    try:
+        enqueue(job_id)
+    except Exception:
+        COMPARE_AND_DELETE(keys=[key], args=[job_id])
+        raise
+
+    return job_id, False
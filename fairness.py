@@ -0,0 +1,255 @@
+import os, json, time, threading
+from celery import signature
+from celery.result import AsyncResult
+from celery.signals import task_postrun, task_revoked, worker_ready
+from celery.states import READY_STATES
+from logger import logger
+from profiling import profile_requested
+from queues import get_queue_depth
+from redis_client import redis_client
+
+FAIR_SCHEDULING_ENABLED = os.getenv("FAIR_SCHEDULING_ENABLED", "true").lower() == "true"
+# Tasks each tenant may have queued or running per pool
+FAIR_CAPS = json.loads(os.getenv("FAIR_CAPS") or '{"video": 2, "content": 14}')
+# Per-tenant cap multipliers, e.g. {"Acme/Jane": 2}
+FAIR_TENANT_WEIGHTS = json.loads(os.getenv("FAIR_TENANT_WEIGHTS") or "{}")
+# Extra tasks released past the caps per dispatch while a pool's queue is empty
+FAIR_IDLE_DISPATCH = int(os.getenv("FAIR_IDLE_DISPATCH", 2))
+# In-flight entries older than this are assumed lost (killed worker, revoke)
+FAIR_INFLIGHT_TIMEOUT = int(os.getenv("FAIR_INFLIGHT_TIMEOUT", 4 * 60 * 60))
+# Seconds between dispatch passes run by every worker, which also free slots
+# of tasks that finished without a postrun (killed child, revoked)
+FAIR_DISPATCH_INTERVAL = float(os.getenv("FAIR_DISPATCH_INTERVAL", 2))
+FAIR_SWEEP_INTERVAL = float(os.getenv("FAIR_SWEEP_INTERVAL", 60))
+
+# Queue a task and put its tenant on the ring if it is not already there
+SUBMIT = """
+redis.call("rpush", KEYS[1], ARGV[2])
+if redis.call("sadd", KEYS[2], ARGV[1]) == 1 then
+    redis.call("rpush", KEYS[3], ARGV[1])
+end
+"""
+# Take a tenant off the ring, unless a task was queued for it meanwhile
+REMOVE_IF_EMPTY = """
+if redis.call("llen", KEYS[1]) == 0 then
+    redis.call("lrem", KEYS[3], 0, ARGV[1])
+    redis.call("srem", KEYS[2], ARGV[1])
+    return 1
+end
+return 0
+"""
+
+
+class FairScheduler:
+    """
+    Per-tenant fair queuing in front of Celery.
+
+    Submitted tasks wait in a Redis list per tenant and pool. Each pool sends
+    them to Celery round-robin across tenants, keeping at most the tenant's
+    cap queued or running at once. A slot is freed when a task finishes (not
+    when it retries), and the next tenant in turn is dispatched. Tenants may
+    go past their cap while the pool's Celery queue is empty, so a lone big
+    tenant still uses idle workers.
+
+    Dispatching never waits: whoever holds a pool's dispatch lock runs
+    another pass for submissions that arrive meanwhile, and workers run a
+    pass every FAIR_DISPATCH_INTERVAL seconds.
+    """
+
+    def __init__(self, celery, pools):
+        self.celery = celery
+        # Pool name -> Celery queue it dispatches to
+        self.pools = pools
+        self.submit_script = redis_client.register_script(SUBMIT)
+        self.remove_if_empty_script = redis_client.register_script(REMOVE_IF_EMPTY)
+        self.swept_at = {}
+        task_postrun.connect(self.on_task_postrun, weak=False)
+        task_revoked.connect(self.on_task_revoked, weak=False)
+        worker_ready.connect(self.on_worker_ready, weak=False)
+
+    def submit(self, sig, tenant, pool, dispatch=True):
+        """
+        Queue a signature for `tenant`. Web requests pass dispatch=False and
+        leave sending it to Celery to a running or periodic dispatch.
+        """
+        if profile_requested():
+            # Published later from the dispatcher, outside this request
+            sig.set(headers={"profile": True})
+        result = sig.freeze()
+        if not FAIR_SCHEDULING_ENABLED:
+            sig.apply_async()
+            return result
+
+        tenant = tenant or "unknown"
+        self.submit_script(
+            keys=[
+                self.key(pool, "pending", tenant),
+                self.key(pool, "tenants"),
+                self.key(pool, "ring"),
+            ],
+            args=[tenant, json.dumps(dict(sig))],
+        )
+        redis_client.set(self.key(pool, "dirty"), 1)
+
+        if dispatch:
+            self.dispatch(pool)
+        return result
+
+    def dispatch(self, pool):
+        lock = redis_client.lock(self.key(pool, "dispatch"), timeout=60)
+        if not lock.acquire(blocking=False):
+            # The holder sees the dirty flag and runs another pass
+            return
+
+        try:
+            self.sweep(pool)
+            redis_client.delete(self.key(pool, "dirty"))
+            while True:
+                # Round-robin up to each tenant's cap, then share out idle capacity
+                while self.dispatch_round(pool, respect_caps=True):
+                    pass
+                for _ in range(FAIR_IDLE_DISPATCH):
+                    if get_queue_depth(self.celery, self.pools[pool]) > 0:
+                        break
+                    if not self.dispatch_round(pool, respect_caps=False, limit=1):
+                        break
+                if not redis_client.delete(self.key(pool, "dirty")):
+                    break
+        finally:
+            lock.release()
+
+    def dispatch_round(self, pool, respect_caps, limit=None):
+        ring_key = self.key(pool, "ring")
+        dispatched = 0
+
+        for _ in range(redis_client.llen(ring_key)):
+            tenant = redis_client.lmove(ring_key, ring_key, "LEFT", "RIGHT")
+            if tenant is None:
+                break
+
+            pending_key = self.key(pool, "pending", tenant)
+            if self.remove_if_empty_script(
+                keys=[pending_key, self.key(pool, "tenants"), ring_key],
+                args=[tenant],
+            ):
+                continue
+
+            if respect_caps and self.get_inflight(pool, tenant) >= self.get_cap(
+                pool, tenant
+            ):
+                continue
+
+            payload = redis_client.lpop(pending_key)
+            if payload is None:
+                continue
+
+            sig = signature(json.loads(payload), app=self.celery)
+            pipe = redis_client.pipeline()
+            pipe.zadd(self.key(pool, "inflight", tenant), {sig.id: time.time()})
+            pipe.sadd(self.key(pool, "active"), tenant)
+            pipe.set(
+                f"fair:task:{sig.id}",
+                json.dumps([pool, tenant]),
+                ex=FAIR_INFLIGHT_TIMEOUT,
+            )
+            pipe.execute()
+            # Not a child of (or profiled with) whichever task happens to
+            # trigger the dispatch
+            headers = {"profile": False, **sig.options.get("headers", {})}
+            try:
+                sig.apply_async(add_to_parent=False, headers=headers)
+            except Exception as e:
+                # Back to the front of the tenant's queue for a later pass
+                logger.error(f"Failed to dispatch {sig.id} for {tenant}: {e}")
+                pipe = redis_client.pipeline()
+                pipe.lpush(pending_key, payload)
+                pipe.zrem(self.key(pool, "inflight", tenant), sig.id)
+                pipe.delete(f"fair:task:{sig.id}")
+                pipe.execute()
+                return 0
+
+            dispatched += 1
+            if limit and dispatched >= limit:
+                break
+
+        return dispatched
+
+    def get_pending(self, pool):
+        """Tasks held back by the scheduler across all tenants of a pool."""
+        tenants = redis_client.smembers(self.key(pool, "tenants"))
+        pipe = redis_client.pipeline()
+        for tenant in tenants:
+            pipe.llen(self.key(pool, "pending", tenant))
+        return sum(pipe.execute())
+
+    def get_inflight(self, pool, tenant):
+        inflight_key = self.key(pool, "inflight", tenant)
+        redis_client.zremrangebyscore(
+            inflight_key, "-inf", time.time() - FAIR_INFLIGHT_TIMEOUT
+        )
+        return redis_client.zcard(inflight_key)
+
+    def sweep(self, pool):
+        """Free the slots of tasks that finished without a postrun."""
+        if time.monotonic() - self.swept_at.get(pool, 0) < FAIR_SWEEP_INTERVAL:
+            return
+        self.swept_at[pool] = time.monotonic()
+
+        # Runs under the dispatch lock, the only place "active" is added to
+        active_key = self.key(pool, "active")
+        for tenant in redis_client.smembers(active_key):
+            inflight_key = self.key(pool, "inflight", tenant)
+            for task_id in redis_client.zrange(inflight_key, 0, -1):
+                if AsyncResult(task_id, app=self.celery).state in READY_STATES:
+                    redis_client.zrem(inflight_key, task_id)
+                    redis_client.delete(f"fair:task:{task_id}")
+            if self.get_inflight(pool, tenant) == 0:
+                redis_client.srem(active_key, tenant)
+
+    def get_cap(self, pool, tenant):
+        weight = FAIR_TENANT_WEIGHTS.get(tenant, 1)
+        return max(1, int(FAIR_CAPS.get(pool, 1) * weight))
+
+    def release(self, task_id):
+        entry = redis_client.get(f"fair:task:{task_id}")
+        if entry is None:
+            return
+
+        pool, tenant = json.loads(entry)
+        pipe = redis_client.pipeline()
+        pipe.zrem(self.key(pool, "inflight", tenant), task_id)
+        pipe.delete(f"fair:task:{task_id}")
+        pipe.execute()
+        self.dispatch(pool)
+
+    def on_task_postrun(self, task_id=None, state=None, **kwargs):
+        # Retries keep their slot until the task finally succeeds or fails
+        if state not in READY_STATES:
+            return
+        try:
+            self.release(task_id)
+        except Exception as e:
+            logger.error(f"Failed to release fair scheduling slot for {task_id}: {e}")
+
+    def on_task_revoked(self, request=None, **kwargs):
+        try:
+            self.release(request.id)
+        except Exception as e:
+            logger.error(
+                f"Failed to release fair scheduling slot for {request.id}: {e}"
+            )
+
+    def on_worker_ready(self, **kwargs):
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def run(self):
+        while True:
+            time.sleep(FAIR_DISPATCH_INTERVAL)
+            for pool in self.pools:
+                try:
+                    self.dispatch(pool)
+                except Exception as e:
+                    logger.error(f"Periodic fair dispatch for {pool} failed: {e}")
+
+    def key(self, pool, name, tenant=None):
+        return f"fair:{pool}:{name}:{tenant}" if tenant else f"fair:{pool}:{name}"
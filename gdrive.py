@@ -4,6 +4,7 @@ from googleapiclient.http import MediaFileUpload, MediaIoBaseDownload
 from datetime import datetime
 import os
 import logging
+import threading
 
 logging.getLogger("googleapiclient.discovery_cache").setLevel(logging.ERROR)
 
@@ -22,9 +23,24 @@ def authenticate():
         raise Exception("No credentials found")
 
 
+_local = threading.local()
+
+
 def get_service():
-    creds = authenticate()
-    return build("drive", "v3", credentials=creds, cache_discovery=False)
+    # Drive clients are not thread safe, so each thread (and forked worker)
+    # builds one from the bundled discovery document and keeps reusing it.
+    # The service account credentials refresh their token on their own.
+    if getattr(_local, "pid", None) != os.getpid():
+        creds = authenticate()
+        _local.service = build(
+            "drive",
+            "v3",
+            credentials=creds,
+            cache_discovery=False,
+            static_discovery=True,
+        )
+        _local.pid = os.getpid()
+    return _local.service
 
 
 def get_folder_id(service, parent_id, folder_name):
@@ -43,7 +59,6 @@ def get_folder_id(service, parent_id, folder_name):
 
 
 def create_folder(service, folder_name, parent_id):
-    service = get_service()
     file_metadata = {
         "name": folder_name,
         "mimeType": "application/vnd.google-apps.folder",
@@ -81,7 +96,7 @@ def upload_video_to_drive(file_name, video_path, upload_to_path):
     return file.get("id")
 
 
-def download_file_from_drive(file_id):
+def download_file_from_drive(file_id, directory="tmp"):
     service = get_service()
 
     file_metadata = None
@@ -92,13 +107,18 @@ def download_file_from_drive(file_id):
 
     request = service.files().get_media(fileId=file_id)
 
-    os.makedirs("tmp", exist_ok=True)
-    file_path = os.path.join("tmp", file_metadata["name"])
-    fh = open(file_path, "wb")
-    downloader = MediaIoBaseDownload(fh, request)
-    done = False
-    while done is False:
-        status, done = downloader.next_chunk()
+    os.makedirs(directory, exist_ok=True)
+    file_path = os.path.join(directory, os.path.basename(file_metadata["name"]))
+    try:
+        with open(file_path, "wb") as fh:
+            downloader = MediaIoBaseDownload(fh, request)
+            done = False
+            while done is False:
+                status, done = downloader.next_chunk()
+    except Exception:
+        if os.path.exists(file_path):
+            os.unlink(file_path)
+        raise
 
     return file_path
 
@@ -0,0 +1,72 @@
+import json
+from datetime import timedelta
+from celery.result import AsyncResult, GroupResult
+from redis_client import redis_client
+
+
+def get_job_status(celery, job_id):
+    group_result = GroupResult.restore(job_id, app=celery)
+    if group_result is not None:
+        status = describe_group(group_result)
+    else:
+        status = describe_result(AsyncResult(job_id, app=celery))
+
+    details = redis_client.get(f"job:{job_id}:details")
+    if details:
+        status.update(json.loads(details))
+    return status
+
+
+def save_job_details(celery, job_id, details):
+    """Report `details` (e.g. skipped items) with a job's status."""
+    expires = celery.conf.result_expires
+    if isinstance(expires, timedelta):
+        expires = expires.total_seconds()
+    redis_client.set(
+        f"job:{job_id}:details",
+        json.dumps(details),
+        ex=int(expires) if expires else None,
+    )
+
+
+def describe(result):
+    if isinstance(result, GroupResult):
+        return describe_group(result)
+    return describe_result(result)
+
+
+def describe_result(result):
+    status = {"job_id": result.id, "state": result.state}
+
+    if result.successful():
+        status["result"] = result.result
+    elif result.failed():
+        status["error"] = str(result.result)
+
+    # Tasks that fan out into groups/chords record them as children
+    children = result.children or []
+    if children:
+        status["children"] = [describe(child) for child in children]
+
+    return status
+
+
+def describe_group(group_result):
+    results = group_result.results or []
+    total = len(results)
+    finished = sum(1 for result in results if result.ready())
+    failed = sum(1 for result in results if result.failed())
+
+    if finished < total:
+        state = "PROGRESS" if finished else "PENDING"
+    else:
+        state = "FAILURE" if failed else "SUCCESS"
+
+    return {
+        "job_id": group_result.id,
+        "state": state,
+        "total": total,
+        "completed": finished,
+        "failed": failed,
+        "children": [describe(result) for result in results],
+    }
@@ -0,0 +1,76 @@
+import os, json, time, hashlib
+import redis
+from logger import logger
+from redis_client import redis_client
+
+CLAUDE_CACHE_ENABLED = os.getenv("CLAUDE_CACHE_ENABLED", "false").lower() == "true"
+CLAUDE_CACHE_TTL = int(os.getenv("CLAUDE_CACHE_TTL", 7 * 24 * 60 * 60))
+# Total size of cached responses before the oldest are evicted
+CLAUDE_CACHE_MAX_BYTES = int(os.getenv("CLAUDE_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+CLAUDE_CACHE_MAX_ENTRY_BYTES = int(
+    os.getenv("CLAUDE_CACHE_MAX_ENTRY_BYTES", 256 * 1024)
+)
+
+INDEX_KEY = "llm_cache:index"
+SIZES_KEY = "llm_cache:sizes"
+TOTAL_KEY = "llm_cache:bytes"
+
+
+def get_cache_key(model, prompt, **params):
+    prompt_hash = hashlib.sha256(prompt.encode()).hexdigest()
+    params_hash = hashlib.sha256(
+        json.dumps(params, sort_keys=True).encode()
+    ).hexdigest()[:16]
+    return f"llm_cache:{model}:{params_hash}:{prompt_hash}"
+
+
+def get_cached_response(key):
+    try:
+        return redis_client.get(key)
+    except redis.RedisError as e:
+        logger.warning(f"LLM cache read failed: {e}")
+        return None
+
+
+def cache_response(key, response):
+    size = len(response.encode())
+    if size > CLAUDE_CACHE_MAX_ENTRY_BYTES:
+        return
+
+    try:
+        previous_size = int(redis_client.hget(SIZES_KEY, key) or 0)
+        pipe = redis_client.pipeline()
+        pipe.set(key, response, ex=CLAUDE_CACHE_TTL)
+        pipe.zadd(INDEX_KEY, {key: time.time()})
+        pipe.hset(SIZES_KEY, key, size)
+        pipe.incrby(TOTAL_KEY, size - previous_size)
+        pipe.execute()
+        evict()
+    except redis.RedisError as e:
+        logger.warning(f"LLM cache write failed: {e}")
+
+
+def evict():
+    # Drop index entries whose values already expired
+    expired = redis_client.zrangebyscore(
+        INDEX_KEY, "-inf", time.time() - CLAUDE_CACHE_TTL
+    )
+    for key in expired:
+        remove_entry(key)
+
+    while int(redis_client.get(TOTAL_KEY) or 0) > CLAUDE_CACHE_MAX_BYTES:
+        oldest = redis_client.zrange(INDEX_KEY, 0, 0)
+        if not oldest:
+            redis_client.set(TOTAL_KEY, 0)
+            break
+        remove_entry(oldest[0])
+
+
+def remove_entry(key):
+    size = int(redis_client.hget(SIZES_KEY, key) or 0)
+    pipe = redis_client.pipeline()
+    pipe.delete(key)
+    pipe.zrem(INDEX_KEY, key)
+    pipe.hdel(SIZES_KEY, key)
+    pipe.decrby(TOTAL_KEY, size)
+    pipe.execute()
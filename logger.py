@@ -1,5 +1,172 @@
-import logging
+import os, copy, json, queue, atexit, logging, contextvars
+from contextlib import contextmanager
+from logging.handlers import QueueHandler, QueueListener
+from celery import current_task
+from celery.signals import setup_logging
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+# "text" or "json" (one object per line, for log drains)
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+# Messages longer than this are cut, so transcripts never reach the drain
+LOG_MAX_LENGTH = int(os.getenv("LOG_MAX_LENGTH", 2000))
+# Records waiting for the writer thread; further records are dropped
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10000))
+
+_stage = contextvars.ContextVar("stage", default=None)
+_formatter = logging.Formatter()
+
+
+@contextmanager
+def log_stage(stage):
+    """Tag log records emitted inside the block with a pipeline stage."""
+    token = _stage.set(stage)
+    try:
+        yield
+    finally:
+        _stage.reset(token)
+
+
+def truncate(text, max_length=LOG_MAX_LENGTH, keep_end=False):
+    if len(text) <= max_length:
+        return text
+    if keep_end:
+        return f"[{len(text) - max_length} chars truncated] ...{text[-max_length:]}"
+    return f"{text[:max_length]}... [{len(text) - max_length} chars truncated]"
+
+
+class ContextFilter(logging.Filter):
+    def filter(self, record):
+        task = current_task
+        record.task_id = task.request.id if task and task.request else None
+        record.stage = _stage.get()
+        return True
+
+
+class BoundedQueueHandler(QueueHandler):
+    """
+    Hands records to the writer thread after formatting and truncating the
+    message in the calling thread. Records are dropped (and counted) rather
+    than blocking the caller when the writer falls behind.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # The message and traceback are cut separately, keeping the end of
+        # the traceback where the exception itself is
+        details = []
+        if record.exc_info:
+            details.append(_formatter.formatException(record.exc_info))
+        elif record.exc_text:
+            details.append(record.exc_text)
+        if record.stack_info:
+            details.append(_formatter.formatStack(record.stack_info))
+
+        record = copy.copy(record)
+        record.msg = "\n".join(
+            [truncate(record.getMessage())]
+            + [truncate(detail, keep_end=True) for detail in details]
+        )
+        record.message = record.msg
+        record.args = None
+        record.exc_info = None
+        record.exc_text = None
+        record.stack_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            return
+
+        if self.dropped:
+            dropped, self.dropped = self.dropped, 0
+            self.enqueue(
+                logging.makeLogRecord(
+                    {
+                        "name": __name__,
+                        "levelno": logging.WARNING,
+                        "levelname": "WARNING",
+                        "msg": f"Dropped {dropped} log records, queue full",
+                        "task_id": None,
+                        "stage": None,
+                    }
+                )
+            )
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        context = "/".join(
+            str(value)
+            for value in (
+                getattr(record, "task_id", None),
+                getattr(record, "stage", None),
+            )
+            if value
+        )
+        record.context = f"[{context}] " if context else ""
+        return super().format(record)
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        # Tracebacks are already part of the message, see BoundedQueueHandler.prepare
+        data = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "task_id": getattr(record, "task_id", None),
+            "stage": getattr(record, "stage", None),
+        }
+        return json.dumps(data, default=str)
+
+
+def start_logging():
+    """Route the root logger through a queue to a background writer thread."""
+    global _listener
+
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(
+        JsonFormatter()
+        if LOG_FORMAT == "json"
+        else TextFormatter("%(levelname)s:%(name)s:%(context)s%(message)s")
+    )
+
+    log_queue = queue.Queue(LOG_QUEUE_SIZE)
+    queue_handler = BoundedQueueHandler(log_queue)
+    queue_handler.addFilter(ContextFilter())
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(LOG_LEVEL)
+
+    _listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+
+
+def stop_logging():
+    _listener.stop()
+
+
+_listener = None
+start_logging()
+atexit.register(stop_logging)
+# The writer thread does not survive a fork (gunicorn / prefork workers)
+os.register_at_fork(after_in_child=start_logging)
+
+
+@setup_logging.connect
+def keep_logging_config(**kwargs):
+    # Stops Celery workers replacing the root handlers with synchronous ones
+    pass
 
 
-logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
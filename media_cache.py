@@ -0,0 +1,122 @@
+import os, shutil, hashlib, threading
+from logger import logger
+
+MEDIA_CACHE_DIR = os.getenv("MEDIA_CACHE_DIR", "media_cache")
+MEDIA_CACHE_MAX_MB = int(os.getenv("MEDIA_CACHE_MAX_MB", 4096))
+
+stats = {"hits": 0, "misses": 0, "evictions": 0, "evicted_bytes": 0}
+stats_lock = threading.Lock()
+
+
+def get_cache_path(key, extension=""):
+    digest = hashlib.sha256(key.encode()).hexdigest()[:32]
+    return os.path.join(MEDIA_CACHE_DIR, f"{digest}{extension}")
+
+
+def find_cached(key):
+    prefix = os.path.basename(get_cache_path(key))
+    if not os.path.isdir(MEDIA_CACHE_DIR):
+        return None
+    for name in os.listdir(MEDIA_CACHE_DIR):
+        if name.startswith(prefix) and not name.endswith(".part"):
+            return os.path.join(MEDIA_CACHE_DIR, name)
+    return None
+
+
+def link_or_copy(source, destination):
+    # Hard links share the data without copying and survive eviction of the
+    # other name; fall back to a copy across filesystems
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copyfile(source, destination)
+
+
+def record(stat, amount=1):
+    with stats_lock:
+        stats[stat] += amount
+
+
+def get_media_cache_stats():
+    with stats_lock:
+        return dict(stats)
+
+
+def get_cached_media(key, directory):
+    """Link the cached file for `key` into `directory`, or return None."""
+    if not key:
+        return None
+
+    cached_path = find_cached(key)
+    if cached_path is None:
+        record("misses")
+        return None
+
+    destination = os.path.join(directory, os.path.basename(cached_path))
+    try:
+        link_or_copy(cached_path, destination)
+    except OSError:
+        # Evicted between lookup and link
+        record("misses")
+        return None
+
+    # Mark as recently used
+    os.utime(cached_path)
+    record("hits")
+    logger.info(f"Media cache hit for {key}")
+    return destination
+
+
+def cache_media(path, keys):
+    """Keep a copy of `path` under every key in `keys`, evicting LRU files."""
+    os.makedirs(MEDIA_CACHE_DIR, exist_ok=True)
+    extension = os.path.splitext(path)[1]
+
+    for key in filter(None, keys):
+        cache_path = get_cache_path(key, extension)
+        temp_path = f"{cache_path}.{os.getpid()}.part"
+        try:
+            # A cache hit is a link to the cached file already; renaming a
+            # link onto its own file is a no-op that leaves the .part behind
+            if os.path.exists(cache_path) and os.path.samefile(path, cache_path):
+                continue
+            link_or_copy(path, temp_path)
+            os.replace(temp_path, cache_path)
+        except OSError as e:
+            logger.warning(f"Failed to cache media for {key}: {e}")
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+
+    evict()
+
+
+def evict(max_bytes=None):
+    max_bytes = MEDIA_CACHE_MAX_MB * 1024 * 1024 if max_bytes is None else max_bytes
+
+    # Names linking the same file share its data, so group them by inode
+    files = {}
+    for entry in os.scandir(MEDIA_CACHE_DIR):
+        try:
+            stat = entry.stat()
+        except OSError:
+            continue
+        names, size, last_used = files.get(stat.st_ino, ([], stat.st_size, 0))
+        names.append(entry.path)
+        files[stat.st_ino] = (names, size, max(last_used, stat.st_mtime))
+
+    total = sum(size for _, size, _ in files.values())
+    for names, size, _ in sorted(files.values(), key=lambda file: file[2]):
+        if total <= max_bytes:
+            break
+        for name in names:
+            try:
+                os.unlink(name)
+            except OSError:
+                pass
+        total -= size
+        record("evictions")
+        record("evicted_bytes", size)
+
+    if total > max_bytes:
+        logger.warning(f"Media cache over limit: {total} bytes")
+    logger.info(f"Media cache: {total} bytes cached, stats {get_media_cache_stats()}")
@@ -1,17 +1,87 @@
-import os, requests
+import os, time, threading, requests
+from datetime import datetime, timedelta, timezone
+from requests.adapters import HTTPAdapter
 from logger import logger
 
 
 USER_TOKEN = os.getenv("METRICOOL_USER_TOKEN")
 API_URL = "https://app.metricool.com/api"
 
+METRICOOL_CONCURRENCY = int(os.getenv("METRICOOL_CONCURRENCY", 4))
+# Requests per second across all threads of this process
+METRICOOL_RATE_LIMIT = float(os.getenv("METRICOOL_RATE_LIMIT", 2))
+METRICOOL_MAX_RETRIES = int(os.getenv("METRICOOL_MAX_RETRIES", 3))
+METRICOOL_TIMEOUT = int(os.getenv("METRICOOL_TIMEOUT", 60))
+
+# Keep-alive connections shared by every Metricool call
+session = requests.Session()
+session.mount("https://", HTTPAdapter(pool_maxsize=METRICOOL_CONCURRENCY))
+
+rate_limit_lock = threading.Lock()
+next_request_at = 0.0
+
+
+def wait_for_rate_limit():
+    global next_request_at
+
+    with rate_limit_lock:
+        now = time.monotonic()
+        wait = next_request_at - now
+        next_request_at = max(now, next_request_at) + 1 / METRICOOL_RATE_LIMIT
+
+    if wait > 0:
+        time.sleep(wait)
+
+
+def get_retry_after(response, attempt):
+    try:
+        return float(response.headers["Retry-After"])
+    except (KeyError, ValueError):
+        return 2**attempt
+
+
+def metricool_request(method, url, **kwargs):
+    for attempt in range(METRICOOL_MAX_RETRIES + 1):
+        wait_for_rate_limit()
+        response = session.request(method, url, timeout=METRICOOL_TIMEOUT, **kwargs)
+        if response.status_code != 429 or attempt == METRICOOL_MAX_RETRIES:
+            return response
+
+        retry_after = get_retry_after(response, attempt)
+        logger.info(f"Metricool rate limited, retrying in {retry_after} seconds...")
+        time.sleep(retry_after)
+
+
+def build_scheduled_post_data(platform, post_text, media_urls):
+    scheduled_post_data = {
+        "providers": [{"network": platform}],
+        "publicationDate": {
+            "dateTime": (datetime.now(timezone.utc) + timedelta(days=1)).strftime(
+                "%Y-%m-%dT%H:%M:%S"
+            ),
+            "timezone": "Australia/Adelaide",
+        },
+        "text": post_text,
+        "media": media_urls,
+        "autoPublish": True,
+        "shortener": True,
+        "descendants": [],
+    }
+
+    if platform == "pinterest":
+        scheduled_post_data["pinterestData"] = {"pinNewFormat": True}
+
+    return scheduled_post_data
+
 
 def schedule_metricool_post(blog_id, user_id, post_data):
     url = f"{API_URL}/v2/scheduler/posts"
     params = {"blogId": blog_id, "userId": user_id, "userToken": USER_TOKEN}
     headers = {"Content-Type": "application/json"}
 
-    return requests.post(url, json=post_data, headers=headers, params=params)
+    return metricool_request(
+        "POST", url, json=post_data, headers=headers, params=params
+    )
 
 
 def create_metricool_list_post(blog_id, user_id, list_id):
@@ -19,7 +89,8 @@ def create_metricool_list_post(blog_id, user_id, list_id):
         f"Creating metricool list post for blog {blog_id}, user {user_id} and list {list_id}."
     )
     url = f"{API_URL}/lists/posts/create"
-    return requests.get(
+    return metricool_request(
+        "GET",
         url,
         params={
             "blogId": blog_id,
@@ -44,4 +115,4 @@ def update_metricool_list_post(
         "pictures": (None, str(media_urls)),
     }
 
-    return requests.post(url, files=payload, params=params)
+    return metricool_request("POST", url, files=payload, params=params)
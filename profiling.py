@@ -0,0 +1,227 @@
+import os, sys, time, random, pstats, cProfile, threading, tracemalloc
+from collections import Counter
+from flask import g, has_request_context, request
+from celery import current_task
+from celery.signals import before_task_publish, task_prerun, task_postrun
+from logger import logger
+
+# Task names / Flask endpoints to profile, comma-separated ("*" for all)
+PROFILE_TASKS = [t for t in os.getenv("PROFILE_TASKS", "").split(",") if t]
+PROFILE_ROUTES = [r for r in os.getenv("PROFILE_ROUTES", "").split(",") if r]
+# Fraction of matching tasks / requests that are profiled
+PROFILE_RATE = float(os.getenv("PROFILE_RATE", 1.0))
+# "sample" (low overhead, fine to leave on) or "deterministic" (cProfile)
+PROFILE_MODE = os.getenv("PROFILE_MODE", "sample")
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", 0.01))
+# Process-wide and costly for every thread, so only for targeted debugging;
+# in thread pools it also counts other tasks' allocations
+PROFILE_TRACEMALLOC = os.getenv("PROFILE_TRACEMALLOC", "false").lower() == "true"
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+# Oldest profiles are removed past either limit
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", 300))
+PROFILE_MAX_MB = int(os.getenv("PROFILE_MAX_MB", 200))
+# Request header that profiles a request and the tasks it queues
+PROFILE_HEADER = "X-Profile"
+
+_tracemalloc_lock = threading.Lock()
+_tracemalloc_users = 0
+_tracemalloc_started = False
+
+
+class Sampler:
+    """Samples one thread's stack every interval into collapsed stack counts."""
+
+    def __init__(self, thread_id, interval=PROFILE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(
+                    f"{code.co_name} ({os.path.basename(code.co_filename)}:"
+                    f"{frame.f_lineno})"
+                )
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def dump(self, path):
+        # One "frame;frame;frame count" line per stack, for flamegraph tools
+        with open(path, "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+class Profile:
+    """
+    Profiles the current thread until stopped and writes the results under
+    PROFILE_DIR as <name>.collapsed (sample) or <name>.prof (deterministic),
+    plus <name>.memory.txt with the top allocations when PROFILE_TRACEMALLOC
+    is on.
+    """
+
+    def __init__(self, name, mode=None):
+        self.name = name
+        self.mode = mode or PROFILE_MODE
+        self.profiler = None
+        self.snapshot = None
+        self.started_at = None
+
+    def start(self):
+        if PROFILE_TRACEMALLOC:
+            start_tracemalloc()
+            self.snapshot = tracemalloc.take_snapshot()
+
+        if self.mode == "deterministic":
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        else:
+            self.profiler = Sampler(threading.get_ident())
+            self.profiler.start()
+        self.started_at = time.time()
+        return self
+
+    def stop(self):
+        duration = time.time() - self.started_at
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        path = os.path.join(PROFILE_DIR, self.name)
+
+        if self.mode == "deterministic":
+            self.profiler.disable()
+            pstats.Stats(self.profiler).dump_stats(f"{path}.prof")
+        else:
+            self.profiler.stop()
+            self.profiler.dump(f"{path}.collapsed")
+
+        if self.snapshot is not None:
+            stats = tracemalloc.take_snapshot().compare_to(self.snapshot, "lineno")
+            current, peak = tracemalloc.get_traced_memory()
+            with open(f"{path}.memory.txt", "w") as f:
+                f.write(f"current={current} peak={peak}\n")
+                for stat in stats[:50]:
+                    f.write(f"{stat}\n")
+            stop_tracemalloc()
+
+        logger.info(f"Wrote profile {path} ({duration:.1f}s)")
+        prune_profiles()
+
+
+def prune_profiles():
+    entries = []
+    for entry in os.scandir(PROFILE_DIR):
+        try:
+            stat = entry.stat()
+        except OSError:
+            continue
+        entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+    entries.sort(reverse=True)
+    count = total = 0
+    for _, size, path in entries:
+        count += 1
+        total += size
+        if count > PROFILE_MAX_FILES or total > PROFILE_MAX_MB * 1024 * 1024:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+
+def start_tracemalloc():
+    # Shared by concurrent profiles; left alone if something else started it
+    global _tracemalloc_users, _tracemalloc_started
+    with _tracemalloc_lock:
+        if _tracemalloc_users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _tracemalloc_started = True
+        _tracemalloc_users += 1
+
+
+def stop_tracemalloc():
+    global _tracemalloc_users, _tracemalloc_started
+    with _tracemalloc_lock:
+        _tracemalloc_users -= 1
+        if _tracemalloc_users == 0 and _tracemalloc_started:
+            tracemalloc.stop()
+            _tracemalloc_started = False
+
+
+def should_profile(name, names, requested=False):
+    if requested:
+        return True
+    if "*" not in names and name not in names:
+        return False
+    return random.random() < PROFILE_RATE
+
+
+def setup_profiling(app):
+    """Profile Flask routes and Celery tasks on demand."""
+
+    @app.before_request
+    def start_request_profile():
+        requested = bool(request.headers.get(PROFILE_HEADER))
+        g.profile_requested = requested
+        if should_profile(request.endpoint, PROFILE_ROUTES, requested):
+            name = f"route-{request.endpoint}-{int(time.time() * 1000)}"
+            g.profile = Profile(name).start()
+
+    @app.teardown_request
+    def stop_request_profile(exc=None):
+        profile = g.pop("profile", None)
+        if profile is not None:
+            try:
+                profile.stop()
+            except Exception as e:
+                logger.error(f"Failed to write profile {profile.name}: {e}")
+
+
+def profile_requested():
+    """Whether work queued now is for a profiled request or task."""
+    if has_request_context():
+        return bool(g.get("profile_requested"))
+    task = current_task
+    return bool(task and task.request and task.request.get("profile"))
+
+
+# Tasks queued while serving a profiled request or task carry a "profile"
+# header; it can also be passed directly with apply_async(headers={"profile":
+# True}), or set on a signature published later (see FairScheduler.submit)
+@before_task_publish.connect
+def mark_profiled_task(headers=None, **kwargs):
+    if profile_requested():
+        # Left alone when the publisher already decided
+        headers.setdefault("profile", True)
+
+
+_task_profiles = {}
+
+
+@task_prerun.connect
+def start_task_profile(task_id=None, task=None, **kwargs):
+    name = task.name.rsplit(".", 1)[-1]
+    if should_profile(name, PROFILE_TASKS, bool(task.request.get("profile"))):
+        _task_profiles[task_id] = Profile(f"task-{name}-{task_id}").start()
+
+
+@task_postrun.connect
+def stop_task_profile(task_id=None, **kwargs):
+    profile = _task_profiles.pop(task_id, None)
+    if profile is not None:
+        try:
+            profile.stop()
+        except Exception as e:
+            logger.error(f"Failed to write profile {profile.name}: {e}")
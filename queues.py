@@ -0,0 +1,56 @@
+import os, json
+from kombu.exceptions import ChannelError
+
+# Media/CPU work (audio decoding, image editing, large file transfers)
+MEDIA_QUEUE = os.getenv("CELERY_MEDIA_QUEUE", "media")
+# Network-bound work (Claude, Metricool, Cloudinary)
+LLM_QUEUE = os.getenv("CELERY_LLM_QUEUE", "llm")
+# Quick Airtable housekeeping
+HOUSEKEEPING_QUEUE = os.getenv("CELERY_HOUSEKEEPING_QUEUE", "housekeeping")
+
+# Worker processes (dynos) consuming each queue
+QUEUE_WORKERS = {
+    MEDIA_QUEUE: int(os.getenv("CELERY_MEDIA_WORKERS", 1)),
+    LLM_QUEUE: int(os.getenv("CELERY_LLM_WORKERS", 1)),
+    HOUSEKEEPING_QUEUE: int(os.getenv("CELERY_HOUSEKEEPING_WORKERS", 1)),
+}
+# Worker slots consuming each queue (per-worker concurrency x worker count),
+# matching the Procfile defaults
+QUEUE_CONCURRENCY = {
+    MEDIA_QUEUE: int(os.getenv("CELERY_MEDIA_CONCURRENCY", 2))
+    * QUEUE_WORKERS[MEDIA_QUEUE],
+    LLM_QUEUE: int(os.getenv("CELERY_LLM_CONCURRENCY", 16)) * QUEUE_WORKERS[LLM_QUEUE],
+    HOUSEKEEPING_QUEUE: int(os.getenv("CELERY_HOUSEKEEPING_CONCURRENCY", 8))
+    * QUEUE_WORKERS[HOUSEKEEPING_QUEUE],
+}
+
+DEFAULT_TASK_ROUTES = {
+    "app.process_video_task": MEDIA_QUEUE,
+    "app.upload_to_youtube_task": MEDIA_QUEUE,
+    "app.generate_content_for_platform": LLM_QUEUE,
+    "app.post_to_list_task": LLM_QUEUE,
+    "app.schedule_posts_task": LLM_QUEUE,
+    "app.split_out_tweets_task": HOUSEKEEPING_QUEUE,
+    "app.encrypt_key_task": HOUSEKEEPING_QUEUE,
+    "app.generate_content_batch_task": HOUSEKEEPING_QUEUE,
+    "app.queue_content_generation_task": HOUSEKEEPING_QUEUE,
+}
+
+
+def get_task_routes():
+    """Task name -> queue, overridable with CELERY_TASK_ROUTES as a JSON object."""
+    routes = dict(DEFAULT_TASK_ROUTES)
+    routes.update(json.loads(os.getenv("CELERY_TASK_ROUTES") or "{}"))
+    return {name: {"queue": queue} for name, queue in routes.items()}
+
+
+def get_queue_depth(celery, queue):
+    """Messages waiting in a broker queue (not counting reserved/ETA tasks)."""
+    with celery.connection_for_write() as connection:
+        try:
+            return connection.default_channel.queue_declare(
+                queue=queue, passive=True
+            ).message_count
+        except ChannelError:
+            # Redis drops empty queues
+            return 0
@@ -0,0 +1,6 @@
+import os
+import redis
+
+REDIS_URL = os.getenv("REDIS_URL") or "redis://localhost:6379/"
+
+redis_client = redis.Redis.from_url(REDIS_URL, decode_responses=True)
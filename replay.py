@@ -0,0 +1,153 @@
+"""
+Replay a captured session against a locally running stack.
+
+Start the web and worker processes with REPLAY_DIR (and REPLAY_SPEED) set so
+external calls are answered from the capture, then run:
+
+    python replay.py captures/<session> --speed 10 --url http://localhost:8000
+"""
+
+import os, glob, json, time, uuid, argparse, statistics
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import requests
+
+FINISHED_STATES = ("SUCCESS", "FAILURE")
+
+
+def load_requests(directory):
+    records = []
+    for path in glob.glob(os.path.join(directory, "requests-*.jsonl")):
+        with open(path) as f:
+            records.extend(json.loads(line) for line in f if line.strip())
+    return sorted(records, key=lambda r: r["t"])
+
+
+def replay_request(session, url, record, idempotency_key, timeout, poll_interval):
+    headers = dict(record["headers"])
+    # Replays of one capture must not be deduplicated against each other
+    headers["Idempotency-Key"] = idempotency_key
+
+    started = time.monotonic()
+    response = session.post(
+        url + record["path"], json=record["json"], headers=headers, timeout=60
+    )
+    result = {
+        "path": record["path"],
+        "status": response.status_code,
+        "latency": time.monotonic() - started,
+    }
+
+    job_id = response.json().get("job_id") if response.ok else None
+    if not job_id:
+        return result
+
+    state = None
+    deadline = started + timeout
+    while time.monotonic() < deadline:
+        state = session.get(f"{url}/jobs/{job_id}", timeout=60).json()["state"]
+        if state in FINISHED_STATES:
+            break
+        time.sleep(poll_interval)
+    else:
+        state = "TIMEOUT"
+
+    result["job_state"] = state
+    result["end_to_end"] = time.monotonic() - started
+    return result
+
+
+def percentiles(values):
+    if not values:
+        return None
+    values = sorted(values)
+    pick = lambda p: values[min(len(values) - 1, int(p * len(values)))]
+    return {
+        "p50": round(statistics.median(values), 3),
+        "p95": round(pick(0.95), 3),
+        "p99": round(pick(0.99), 3),
+        "max": round(values[-1], 3),
+    }
+
+
+def replay(directory, url, speed, concurrency, timeout, poll_interval):
+    records = load_requests(directory)
+    if not records:
+        raise Exception(f"No captured requests in {directory}")
+
+    run_id = uuid.uuid4().hex[:8]
+    session = requests.Session()
+    session.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=concurrency))
+
+    started = time.monotonic()
+    first = records[0]["t"]
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = []
+        for i, record in enumerate(records):
+            # Keep the captured arrival pattern, compressed by `speed`
+            delay = (record["t"] - first) / speed - (time.monotonic() - started)
+            if delay > 0:
+                time.sleep(delay)
+            futures.append(
+                executor.submit(
+                    replay_request,
+                    session,
+                    url,
+                    record,
+                    f"replay-{run_id}-{i}",
+                    timeout,
+                    poll_interval,
+                )
+            )
+        results = [future.result() for future in futures]
+    duration = time.monotonic() - started
+
+    jobs = [r for r in results if "job_state" in r]
+    return {
+        "requests": len(results),
+        "duration": round(duration, 3),
+        "speed": speed,
+        "requests_per_second": round(len(results) / duration, 3),
+        "statuses": dict(Counter(r["status"] for r in results)),
+        "latency": percentiles([r["latency"] for r in results]),
+        "captured_latency": percentiles(
+            [r["latency"] for r in records if "latency" in r]
+        ),
+        "jobs": dict(Counter(r["job_state"] for r in jobs)),
+        "jobs_per_second": round(
+            sum(r["job_state"] == "SUCCESS" for r in jobs) / duration, 3
+        ),
+        "end_to_end": percentiles([r["end_to_end"] for r in jobs]),
+        "by_path": {
+            path: percentiles([r["latency"] for r in results if r["path"] == path])
+            for path in sorted({r["path"] for r in results})
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a captured session.")
+    parser.add_argument("directory", help="captures/<session>")
+    parser.add_argument("--url", default="http://localhost:5000")
+    parser.add_argument("--speed", type=float, default=1)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--timeout", type=float, default=60 * 60)
+    parser.add_argument("--poll-interval", type=float, default=2)
+    args = parser.parse_args()
+
+    if not 1 <= args.speed <= 50:
+        parser.error("--speed must be between 1 and 50")
+
+    report = replay(
+        args.directory,
+        args.url.rstrip("/"),
+        args.speed,
+        args.concurrency,
+        args.timeout,
+        args.poll_interval,
+    )
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
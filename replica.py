@@ -0,0 +1,258 @@
+import os, re, json, time, fcntl, sqlite3, threading
+from datetime import datetime, timezone
+from pyairtable import Table, Base
+from pyairtable.formulas import match
+from logger import logger
+
+REPLICA_ENABLED = os.getenv("REPLICA_ENABLED", "true").lower() == "true"
+REPLICA_PATH = os.getenv("REPLICA_PATH", "airtable_replica.sqlite3")
+REPLICA_SYNC_INTERVAL = int(os.getenv("REPLICA_SYNC_INTERVAL", 60))
+REPLICA_FULL_SYNC_INTERVAL = int(os.getenv("REPLICA_FULL_SYNC_INTERVAL", 60 * 60))
+# Reads fall back to Airtable when a table has not synced for this long
+REPLICA_MAX_STALENESS = int(os.getenv("REPLICA_MAX_STALENESS", 15 * 60))
+# Overlap between incremental syncs to absorb clock skew with Airtable
+REPLICA_SYNC_OVERLAP = 60
+
+# Replicated tables and the fields they are looked up by
+REPLICA_INDEXES = json.loads(
+    os.getenv("REPLICA_INDEXES") or '{"Users": ["UserID"], "Keys": ["Provider"]}'
+)
+
+
+def get_index_name(table_name, field):
+    return re.sub(r"\W", "_", f"records_{table_name}_{field}")
+
+
+def get_field_path(field):
+    return "'$.\"{}\"'".format(field.replace("'", "''").replace('"', '\\"'))
+
+
+class AirtableReplica:
+    """
+    Local SQLite copy of mostly static Airtable config tables.
+
+    A background thread per process polls LAST_MODIFIED_TIME() for changed
+    records, with a periodic full sync to pick up deletions. Processes on the
+    same host share the database file and take turns syncing through a lock
+    file. Reads fall back to Airtable while a table is cold or stale, and
+    writes go to Airtable first and then update the local copy.
+    """
+
+    def __init__(self, api, base_id, path=REPLICA_PATH, indexes=REPLICA_INDEXES):
+        self.api = api
+        self.base_id = base_id
+        self.path = path
+        self.indexes = indexes
+        self.local = threading.local()
+        self.thread = None
+        self.thread_pid = None
+        self.thread_lock = threading.Lock()
+
+    def get_table(self, table_name):
+        base = Base(self.api, self.base_id)
+        return Table(None, base, table_name)
+
+    def connect(self):
+        # Connections are per thread and must not be reused across a fork
+        if getattr(self.local, "pid", None) != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self.create_schema(connection)
+            self.local.connection = connection
+            self.local.pid = os.getpid()
+        return self.local.connection
+
+    def create_schema(self, connection):
+        with connection:
+            connection.execute("""CREATE TABLE IF NOT EXISTS records (
+                    table_name TEXT NOT NULL,
+                    record_id TEXT NOT NULL,
+                    created_time TEXT,
+                    fields TEXT NOT NULL,
+                    PRIMARY KEY (table_name, record_id)
+                )""")
+            connection.execute("""CREATE TABLE IF NOT EXISTS sync_state (
+                    table_name TEXT PRIMARY KEY,
+                    synced_at REAL NOT NULL,
+                    full_synced_at REAL NOT NULL
+                )""")
+            for table_name, fields in self.indexes.items():
+                for field in fields:
+                    index_name = get_index_name(table_name, field)
+                    connection.execute(
+                        f"CREATE INDEX IF NOT EXISTS {index_name} ON records "
+                        f"(table_name, json_extract(fields, {get_field_path(field)}))"
+                    )
+
+    # Reads
+
+    def get(self, table_name, record_id):
+        if not self.ensure_fresh(table_name):
+            return self.get_table(table_name).get(record_id)
+
+        row = (
+            self.connect()
+            .execute(
+                "SELECT record_id, created_time, fields FROM records "
+                "WHERE table_name = ? AND record_id = ?",
+                (table_name, record_id),
+            )
+            .fetchone()
+        )
+        if row is None:
+            # Created since the last sync
+            return self.get_table(table_name).get(record_id)
+        return to_record(row)
+
+    def first(self, table_name, field, value):
+        records = self.all(table_name, field, value)
+        return records[0] if records else None
+
+    def all(self, table_name, field=None, value=None, airtable=False):
+        """
+        Records of a table, or those where `field` equals `value`. A lookup
+        that finds nothing (or `airtable=True`) asks Airtable instead, for
+        records created since the last sync.
+        """
+        if airtable or not self.ensure_fresh(table_name):
+            return self.get_airtable_records(table_name, field, value)
+
+        query = (
+            "SELECT record_id, created_time, fields FROM records WHERE table_name = ?"
+        )
+        params = [table_name]
+        if field:
+            query += f" AND json_extract(fields, {get_field_path(field)}) = ?"
+            params.append(value)
+        query += " ORDER BY created_time"
+
+        rows = self.connect().execute(query, params).fetchall()
+        if field and not rows:
+            return self.get_airtable_records(table_name, field, value)
+        return [to_record(row) for row in rows]
+
+    def get_airtable_records(self, table_name, field=None, value=None):
+        formula = match({field: value}) if field else None
+        return self.get_table(table_name).all(formula=formula)
+
+    # Writes
+
+    def update(self, table_name, record_id, fields):
+        record = self.get_table(table_name).update(record_id, fields)
+        if table_name in self.indexes:
+            with self.connect() as connection:
+                self.save_records(connection, table_name, [record])
+        return record
+
+    # Sync
+
+    def ensure_fresh(self, table_name):
+        if not REPLICA_ENABLED or table_name not in self.indexes:
+            return False
+
+        self.start()
+        synced_at = self.get_synced_at(table_name)
+        if synced_at is None or time.time() - synced_at > REPLICA_MAX_STALENESS:
+            self.sync(table_name)
+            synced_at = self.get_synced_at(table_name)
+
+        return synced_at is not None and (
+            time.time() - synced_at <= REPLICA_MAX_STALENESS
+        )
+
+    def get_synced_at(self, table_name, column="synced_at"):
+        row = (
+            self.connect()
+            .execute(
+                f"SELECT {column} FROM sync_state WHERE table_name = ?",
+                (table_name,),
+            )
+            .fetchone()
+        )
+        return row[0] if row else None
+
+    def sync(self, table_name):
+        """Sync one table; skipped when another thread or process is syncing."""
+        with open(f"{self.path}.lock", "w") as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return False
+
+            synced_at = self.get_synced_at(table_name)
+            full_synced_at = self.get_synced_at(table_name, "full_synced_at")
+            now = time.time()
+            if synced_at is not None and now - synced_at < REPLICA_SYNC_INTERVAL:
+                return True
+
+            full = (
+                full_synced_at is None
+                or now - full_synced_at >= REPLICA_FULL_SYNC_INTERVAL
+            )
+            formula = None
+            if not full:
+                since = datetime.fromtimestamp(
+                    synced_at - REPLICA_SYNC_OVERLAP, tz=timezone.utc
+                ).strftime("%Y-%m-%dT%H:%M:%S.000Z")
+                formula = f"IS_AFTER(LAST_MODIFIED_TIME(), '{since}')"
+
+            records = self.get_table(table_name).all(formula=formula)
+
+            with self.connect() as connection:
+                if full:
+                    connection.execute(
+                        "DELETE FROM records WHERE table_name = ?", (table_name,)
+                    )
+                self.save_records(connection, table_name, records)
+                connection.execute(
+                    "INSERT INTO sync_state (table_name, synced_at, full_synced_at) "
+                    "VALUES (?, ?, ?) ON CONFLICT (table_name) DO UPDATE SET "
+                    "synced_at = excluded.synced_at, "
+                    "full_synced_at = excluded.full_synced_at",
+                    (table_name, now, now if full else full_synced_at),
+                )
+
+            logger.info(
+                f"Synced {len(records)} {table_name} records to replica "
+                f"({'full' if full else 'incremental'})"
+            )
+            return True
+
+    def save_records(self, connection, table_name, records):
+        connection.executemany(
+            "INSERT OR REPLACE INTO records "
+            "(table_name, record_id, created_time, fields) VALUES (?, ?, ?, ?)",
+            [
+                (
+                    table_name,
+                    record["id"],
+                    record.get("createdTime"),
+                    json.dumps(record.get("fields", {})),
+                )
+                for record in records
+            ],
+        )
+
+    def start(self):
+        """Start the sync thread for this process (again after a fork)."""
+        with self.thread_lock:
+            if self.thread_pid == os.getpid() and self.thread.is_alive():
+                return
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread_pid = os.getpid()
+            self.thread.start()
+
+    def run(self):
+        while True:
+            for table_name in self.indexes:
+                try:
+                    self.sync(table_name)
+                except Exception as e:
+                    logger.error(f"Failed to sync {table_name} replica: {e}")
+            time.sleep(REPLICA_SYNC_INTERVAL)
+
+
+def to_record(row):
+    record_id, created_time, fields = row
+    return {"id": record_id, "createdTime": created_time, "fields": json.loads(fields)}
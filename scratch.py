@@ -0,0 +1,132 @@
+import os, fcntl, shutil, tempfile, time
+from contextlib import contextmanager
+from logger import logger
+
+SCRATCH_ROOT = os.getenv("SCRATCH_ROOT", "tmp")
+SCRATCH_QUOTA_MB = int(os.getenv("SCRATCH_QUOTA_MB", 8192))
+# Memory-backed filesystem for small artifacts (thumbnails, images)
+SCRATCH_TMPFS_ROOT = os.getenv("SCRATCH_TMPFS_ROOT", "/dev/shm/endgn")
+SCRATCH_TMPFS_QUOTA_MB = int(os.getenv("SCRATCH_TMPFS_QUOTA_MB", 256))
+# Reserved per video task: source file plus decoded wav and its chunks
+SCRATCH_VIDEO_RESERVE_MB = int(os.getenv("SCRATCH_VIDEO_RESERVE_MB", 2048))
+SCRATCH_WAIT_TIMEOUT = int(os.getenv("SCRATCH_WAIT_TIMEOUT", 600))
+# Workspaces older than this belong to killed workers and are removed
+SCRATCH_MAX_AGE = int(os.getenv("SCRATCH_MAX_AGE", 6 * 60 * 60))
+
+RESERVATION_FILE = ".reserved"
+
+
+@contextmanager
+def workspace(prefix="task", memory=False, reserve_mb=0):
+    """
+    Private scratch directory for a single task, removed on exit.
+
+    `reserve_mb` is counted against the quota up front so that concurrent
+    tasks wait for space instead of filling the disk between them.
+    """
+    root, quota_mb = get_scratch_root(memory)
+    path = reserve_space(root, quota_mb, reserve_mb, prefix)
+
+    try:
+        yield path
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def get_scratch_root(memory=False):
+    if memory:
+        try:
+            os.makedirs(SCRATCH_TMPFS_ROOT, exist_ok=True)
+            if os.access(SCRATCH_TMPFS_ROOT, os.W_OK):
+                return SCRATCH_TMPFS_ROOT, SCRATCH_TMPFS_QUOTA_MB
+        except OSError:
+            logger.warning("tmpfs scratch root unavailable, using disk")
+
+    os.makedirs(SCRATCH_ROOT, exist_ok=True)
+    return SCRATCH_ROOT, SCRATCH_QUOTA_MB
+
+
+def reserve_space(root, quota_mb, reserve_mb, prefix):
+    """Wait for quota, then create the workspace and its reservation."""
+    quota = quota_mb * 1024 * 1024
+    needed = reserve_mb * 1024 * 1024
+    deadline = time.monotonic() + SCRATCH_WAIT_TIMEOUT
+    delay = 1
+
+    while True:
+        path, used = try_reserve_space(root, quota, needed, prefix)
+        if path is not None:
+            return path
+
+        if time.monotonic() >= deadline:
+            raise Exception(
+                f"Scratch space exhausted in {root}: {used} bytes used, "
+                f"{needed} requested, quota {quota}"
+            )
+        logger.info(f"Waiting {delay}s for scratch space in {root}")
+        time.sleep(delay)
+        delay = min(delay * 2, 30)
+
+
+def try_reserve_space(root, quota, needed, prefix):
+    # The check and the reservation happen under one lock on the root, so
+    # processes on this host cannot both take the last of the quota
+    fd = os.open(root, os.O_RDONLY)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        remove_stale_workspaces(root)
+        used = get_scratch_usage(root)
+        free = shutil.disk_usage(root).free
+        if used + needed > quota or needed > free:
+            return None, used
+
+        path = tempfile.mkdtemp(prefix=f"{prefix}_", dir=root)
+        if needed:
+            with open(os.path.join(path, RESERVATION_FILE), "w") as f:
+                f.write(str(needed))
+        return path, used
+    finally:
+        os.close(fd)
+
+
+def get_scratch_usage(root):
+    total = 0
+    for entry in os.scandir(root):
+        if entry.is_dir(follow_symlinks=False):
+            total += max(get_dir_size(entry.path), get_reservation(entry.path))
+        elif entry.is_file(follow_symlinks=False):
+            total += entry.stat().st_size
+    return total
+
+
+def get_dir_size(path):
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, filename))
+            except OSError:
+                pass
+    return total
+
+
+def get_reservation(path):
+    try:
+        with open(os.path.join(path, RESERVATION_FILE)) as f:
+            return int(f.read())
+    except (OSError, ValueError):
+        return 0
+
+
+def remove_stale_workspaces(root):
+    cutoff = time.time() - SCRATCH_MAX_AGE
+    for entry in os.scandir(root):
+        try:
+            if entry.stat(follow_symlinks=False).st_mtime < cutoff:
+                if entry.is_dir(follow_symlinks=False):
+                    shutil.rmtree(entry.path, ignore_errors=True)
+                else:
+                    os.unlink(entry.path)
+                logger.info(f"Removed stale scratch entry {entry.path}")
+        except OSError:
+            pass
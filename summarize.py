@@ -0,0 +1,115 @@
+import os, re, hashlib
+from concurrent.futures import ThreadPoolExecutor
+from logger import logger
+from redis_client import redis_client
+from utils import send_prompt_to_claude
+
+# Rough estimate, Claude averages about four characters per token in English
+CHARS_PER_TOKEN = 4
+# Transcripts above this size are replaced by a condensed brief in prompts
+SUMMARY_TOKEN_THRESHOLD = int(os.getenv("SUMMARY_TOKEN_THRESHOLD", 30000))
+SUMMARY_SEGMENT_TOKENS = int(os.getenv("SUMMARY_SEGMENT_TOKENS", 15000))
+# Summarization rounds before the summaries are cut to fit instead
+SUMMARY_MAX_ROUNDS = int(os.getenv("SUMMARY_MAX_ROUNDS", 3))
+SUMMARY_CONCURRENCY = int(os.getenv("SUMMARY_CONCURRENCY", 4))
+SUMMARY_CACHE_TTL = int(os.getenv("SUMMARY_CACHE_TTL", 7 * 24 * 60 * 60))
+SUMMARY_MODEL = os.getenv("SUMMARY_MODEL")
+
+SEGMENT_PROMPT = """Summarize part {part} of {parts} of a long transcript.
+Keep every key point, argument, story, fact, figure, name and memorable quote, in order, and preserve the speaker's voice and tone.
+Respond with the summary only.
+
+{segment}"""
+
+COMBINE_PROMPT = """The following are summaries of consecutive parts of one long transcript.
+Combine them into a single condensed brief that keeps every key point, argument, story, fact, figure, name and memorable quote, in order, and preserves the speaker's voice and tone.
+Respond with the brief only.
+
+{summaries}"""
+
+
+def estimate_tokens(text):
+    return len(text) // CHARS_PER_TOKEN
+
+
+def split_into_segments(text, max_tokens=SUMMARY_SEGMENT_TOKENS):
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    segments = []
+    current = ""
+
+    # Break on sentence and paragraph boundaries where possible
+    for piece in re.split(r"(?<=[.!?\n])\s+", text):
+        while len(piece) > max_chars:
+            if current:
+                segments.append(current)
+                current = ""
+            segments.append(piece[:max_chars])
+            piece = piece[max_chars:]
+
+        if current and len(current) + len(piece) + 1 > max_chars:
+            segments.append(current)
+            current = ""
+        current = f"{current} {piece}" if current else piece
+
+    if current:
+        segments.append(current)
+    return segments
+
+
+def summarize_transcript(text, claude_model, api_key, round=1):
+    segments = split_into_segments(text)
+    logger.info(f"Summarizing transcript in {len(segments)} segments")
+
+    def summarize_segment(args):
+        part, segment = args
+        prompt = SEGMENT_PROMPT.format(part=part, parts=len(segments), segment=segment)
+        return send_prompt_to_claude(prompt, claude_model, api_key)
+
+    with ThreadPoolExecutor(max_workers=SUMMARY_CONCURRENCY) as executor:
+        summaries = list(executor.map(summarize_segment, enumerate(segments, 1)))
+
+    combined = "\n\n".join(summaries)
+    # Summaries of very long inputs may need another round before combining
+    if estimate_tokens(combined) > SUMMARY_TOKEN_THRESHOLD:
+        if round < SUMMARY_MAX_ROUNDS:
+            return summarize_transcript(combined, claude_model, api_key, round + 1)
+        logger.warning(
+            f"Summaries still ~{estimate_tokens(combined)} tokens after "
+            f"{round} rounds, truncating"
+        )
+        combined = combined[: SUMMARY_TOKEN_THRESHOLD * CHARS_PER_TOKEN]
+
+    prompt = COMBINE_PROMPT.format(summaries=combined)
+    return send_prompt_to_claude(prompt, claude_model, api_key)
+
+
+def condense_transcript(text, claude_model, api_key, cache_key):
+    """
+    Return `text` unchanged when it fits under SUMMARY_TOKEN_THRESHOLD,
+    otherwise a condensed brief cached per `cache_key` (submission or video)
+    and content hash.
+    """
+    if not text or estimate_tokens(text) <= SUMMARY_TOKEN_THRESHOLD:
+        return text
+
+    text_hash = hashlib.sha256(text.encode()).hexdigest()[:16]
+    brief_key = f"brief:{cache_key}:{text_hash}"
+
+    brief = redis_client.get(brief_key)
+    if brief is not None:
+        return brief
+
+    # Platform tasks for the same submission share one summarization run
+    with redis_client.lock(
+        f"{brief_key}:lock", timeout=30 * 60, blocking_timeout=30 * 60
+    ):
+        brief = redis_client.get(brief_key)
+        if brief is None:
+            brief = summarize_transcript(text, SUMMARY_MODEL or claude_model, api_key)
+            redis_client.set(brief_key, brief, ex=SUMMARY_CACHE_TTL)
+            logger.info(
+                f"Condensed transcript for {cache_key} from "
+                f"~{estimate_tokens(text)} to ~{estimate_tokens(brief)} tokens"
+            )
+
+    return brief
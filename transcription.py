@@ -1,6 +1,7 @@
 from pydub import AudioSegment
 from openai import OpenAI
 from logger import logger
+from checkpoints import run_stage
 import os
 
 
@@ -12,44 +13,67 @@ def create_audio_chunks(video_path, max_size=24):
     audio_size = os.path.getsize(audio_path) / (1024 * 1024)
     num_chunks = int(audio_size / max_size) + 1
 
-    chunks_folder = os.path.join(os.getcwd(), "tmp", "chunks")
+    # Chunks live next to the video, inside the caller's scratch workspace
+    chunks_folder = os.path.join(os.path.dirname(os.path.abspath(video_path)), "chunks")
     os.makedirs(chunks_folder, exist_ok=True)
 
-    audio = AudioSegment.from_file(audio_path)
-
     audio_chunks_path = []
-    for i in range(num_chunks):
-        start_time = i * len(audio) // num_chunks
-        end_time = (i + 1) * len(audio) // num_chunks
+    try:
+        audio = AudioSegment.from_file(audio_path)
+
+        for i in range(num_chunks):
+            start_time = i * len(audio) // num_chunks
+            end_time = (i + 1) * len(audio) // num_chunks
 
-        audio_chunk = audio[start_time:end_time]
-        path = os.path.join(chunks_folder, f"{filename}_{i}.wav")
-        audio_chunks_path.append(path)
-        audio_chunk.export(path, format="wav")
+            audio_chunk = audio[start_time:end_time]
+            path = os.path.join(chunks_folder, f"{filename}_{i}.wav")
+            audio_chunks_path.append(path)
+            audio_chunk.export(path, format="wav")
+    except Exception:
+        for path in audio_chunks_path:
+            if os.path.exists(path):
+                os.unlink(path)
+        raise
+    finally:
+        os.unlink(audio_path)
 
-    os.unlink(audio_path)
     logger.info("Audio chunks created")
     return audio_chunks_path
 
 
-def transcribe_video(video_path):
-    full_transcription = ""
-    chunk_path = create_audio_chunks(video_path)
-
-    client = OpenAI()
-    for i, path in enumerate(chunk_path):
-        audio_file = open(path, "rb")
-        transcription = client.audio.transcriptions.create(
+def transcribe_chunk(client, path):
+    with open(path, "rb") as audio_file:
+        return client.audio.transcriptions.create(
             model="whisper-1",
             file=audio_file,
             language="en",
             response_format="text",
         )
-        if transcription:
-            full_transcription += transcription
 
-    for i in chunk_path:
-        os.unlink(i)
+
+def transcribe_video(video_path, checkpoint_key=None):
+    full_transcription = ""
+    chunk_path = create_audio_chunks(video_path)
+
+    client = OpenAI()
+    try:
+        for i, path in enumerate(chunk_path):
+            if checkpoint_key:
+                # Chunking is deterministic, so a retry can reuse finished chunks
+                transcription = run_stage(
+                    checkpoint_key,
+                    f"transcript_chunk_{i}",
+                    transcribe_chunk,
+                    client,
+                    path,
+                )
+            else:
+                transcription = transcribe_chunk(client, path)
+            if transcription:
+                full_transcription += transcription
+    finally:
+        for i in chunk_path:
+            os.unlink(i)
 
     logger.info("Transcription completed")
     return full_transcription
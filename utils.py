@@ -1,6 +1,6 @@
 import requests, os, time, textwrap
 from pathlib import Path
-from PIL import Image, ImageFont, ImageDraw
+from PIL import Image, ImageFont, ImageDraw, ImageOps
 from pyairtable import Api, Table, Base
 from logger import logger
 import cloudinary.uploader
@@ -8,16 +8,39 @@ import cloudinary
 from pypdf import PdfReader
 import io
 from docx import Document
+from llm_cache import (
+    get_cache_key,
+    get_cached_response,
+    cache_response,
+    CLAUDE_CACHE_ENABLED,
+)
 
+CLAUDE_MAX_TOKENS = 4096
+CLAUDE_TEMPERATURE = 0.7
 
-def download_tmp_image(url, filename):
+# Crop the four Midjourney grid images locally instead of upscaling one via the API
+MIDJOURNEY_LOCAL_CROP = os.getenv("MIDJOURNEY_LOCAL_CROP", "false").lower() == "true"
+
+# YouTube thumbnails: 1280x720, under 2 MB, JPEG (or WEBP for Cloudinary only)
+THUMBNAIL_SIZE = (1280, 720)
+THUMBNAIL_FORMAT = os.getenv("THUMBNAIL_FORMAT", "JPEG").upper()
+THUMBNAIL_MAX_BYTES = 2 * 1024 * 1024
+
+cloudinary.config(
+    cloud_name=os.getenv("CLOUDINARY_CLOUD_NAME"),
+    api_key=os.getenv("CLOUDINARY_API_KEY"),
+    api_secret=os.getenv("CLOUDINARY_API_SECRET"),
+)
+
+
+def download_tmp_image(url, filename, directory="tmp"):
     response = requests.get(url)
 
     if not response.ok:
         raise Exception("Failed to download image from image_url")
 
-    Path("tmp").mkdir(parents=True, exist_ok=True)
-    file_path = os.path.join("tmp", f"{filename}.png")
+    Path(directory).mkdir(parents=True, exist_ok=True)
+    file_path = os.path.join(directory, f"{os.path.basename(filename)}.png")
 
     with open(file_path, "wb") as f:
         f.write(response.content)
@@ -25,22 +48,38 @@ def download_tmp_image(url, filename):
     return file_path
 
 
-def download_tmp_video(url, file_name):
+def download_image(url):
     response = requests.get(url)
 
     if not response.ok:
-        raise Exception("Failed to download video from video_url")
+        raise Exception("Failed to download image from image_url")
 
-    Path("tmp").mkdir(parents=True, exist_ok=True)
-    file_path = os.path.join("tmp", file_name)
+    img = Image.open(io.BytesIO(response.content))
+    img.load()
+    return img
 
-    with open(file_path, "wb") as f:
-        f.write(response.content)
+
+def download_tmp_video(url, file_name, directory="tmp"):
+    Path(directory).mkdir(parents=True, exist_ok=True)
+    file_path = os.path.join(directory, os.path.basename(file_name))
+
+    with requests.get(url, stream=True) as response:
+        if not response.ok:
+            raise Exception("Failed to download video from video_url")
+
+        try:
+            with open(file_path, "wb") as f:
+                for chunk in response.iter_content(chunk_size=1024 * 1024):
+                    f.write(chunk)
+        except Exception:
+            if os.path.exists(file_path):
+                os.unlink(file_path)
+            raise
 
     return file_path
 
 
-def midjourney_imagine(prompt):
+def midjourney_imagine(prompt, upscale=True):
     imagine_endpoint = "https://api.midjourneyapi.xyz/mj/v2/imagine"
 
     headers = {"X-API-KEY": os.getenv("GO_API_KEY")}
@@ -63,6 +102,10 @@ def midjourney_imagine(prompt):
         raise Exception(f"Invalid prompt")
 
     data = midjourney_refresh(task_id)
+    if not upscale:
+        # URL of the 2x2 grid
+        return data["task_result"].get("image_url")
+
     upscale_task_id = midjourney_upscale(task_id)
     data = midjourney_refresh(upscale_task_id)
 
@@ -121,7 +164,42 @@ def midjourney_upscale(task_id):
         raise Exception(f"Failed to upscale")
 
 
-def send_prompt_to_claude(prompt, claude_model, api_key, retry_count=5):
+def crop_midjourney_grid(grid):
+    # Kept at grid resolution, fit_thumbnail scales them to thumbnail size
+    width, height = grid.size[0] // 2, grid.size[1] // 2
+    return [
+        grid.crop((left, top, left + width, top + height))
+        for left, top in [(0, 0), (width, 0), (0, height), (width, height)]
+    ]
+
+
+def send_prompt_to_claude(
+    prompt, claude_model, api_key, retry_count=5, cache=None, refresh_cache=False
+):
+    """
+    `cache` overrides CLAUDE_CACHE_ENABLED for this call; `refresh_cache`
+    skips the lookup but stores the new response.
+    """
+    use_cache = CLAUDE_CACHE_ENABLED if cache is None else cache
+    if use_cache:
+        key = get_cache_key(
+            claude_model,
+            prompt,
+            max_tokens=CLAUDE_MAX_TOKENS,
+            temperature=CLAUDE_TEMPERATURE,
+        )
+        if not refresh_cache:
+            cached = get_cached_response(key)
+            if cached is not None:
+                logger.info("Claude response served from cache")
+                return cached
+
+        response = send_prompt_to_claude(
+            prompt, claude_model, api_key, retry_count, cache=False
+        )
+        cache_response(key, response)
+        return response
+
     headers = {
         "Content-Type": "application/json",
         "x-api-key": api_key,
@@ -130,8 +208,8 @@ def send_prompt_to_claude(prompt, claude_model, api_key, retry_count=5):
     data_payload = {
         "model": claude_model,
         "messages": [{"role": "user", "content": prompt}],
-        "max_tokens": 4096,
-        "temperature": 0.7,
+        "max_tokens": CLAUDE_MAX_TOKENS,
+        "temperature": CLAUDE_TEMPERATURE,
     }
     response = requests.post(
         "https://api.anthropic.com/v1/messages", json=data_payload, headers=headers
@@ -139,13 +217,16 @@ def send_prompt_to_claude(prompt, claude_model, api_key, retry_count=5):
 
     logger.info(f"Claude response status: {response.status_code}")
     if response.status_code == 200:
-        logger.info(response.json()["content"][0]["text"])
-        return response.json()["content"][0]["text"].strip()
+        text = response.json()["content"][0]["text"]
+        logger.info(f"Claude response: {len(text)} chars")
+        return text.strip()
     elif response.status_code in (429, 418) or response.status_code >= 500:
         if retry_count > 0:
             wait_time = (2 ** (5 - retry_count)) * 0.5
             time.sleep(wait_time)
-            return send_prompt_to_claude(prompt, claude_model, api_key, retry_count - 1)
+            return send_prompt_to_claude(
+                prompt, claude_model, api_key, retry_count - 1, cache=False
+            )
         raise Exception(
             f"Failed to send prompt to Claude. Status: {response.status_code}"
         )
@@ -153,8 +234,7 @@ def send_prompt_to_claude(prompt, claude_model, api_key, retry_count=5):
         raise Exception(f"Failed to send prompt to Claude. Status: {response.content}")
 
 
-def edit_hook_to_image(text, img_path):
-    img = Image.open(img_path)
+def edit_hook_to_image(text, img):
     wrapped_text = textwrap.wrap(text, width=40)
     font_size = 1
     img_fraction = 1.6
@@ -188,17 +268,34 @@ def edit_hook_to_image(text, img_path):
         draw.text((x_offset, y_offset), line, (255, 255, 255), font=font)
         y_offset += height + 16
 
-    img.save(img_path)
     logger.info("Edited hook to Image")
+    return img
 
 
-def upload_image(img_path):
-    cloudinary.config(
-        cloud_name=os.getenv("CLOUDINARY_CLOUD_NAME"),
-        api_key=os.getenv("CLOUDINARY_API_KEY"),
-        api_secret=os.getenv("CLOUDINARY_API_SECRET"),
-    )
-    return cloudinary.uploader.upload(img_path)
+def fit_thumbnail(img, size=THUMBNAIL_SIZE):
+    img = img.convert("RGB")
+    if img.size != size:
+        img = ImageOps.fit(img, size, Image.Resampling.LANCZOS)
+    return img
+
+
+def encode_thumbnail(img, format=THUMBNAIL_FORMAT, max_bytes=THUMBNAIL_MAX_BYTES):
+    img = fit_thumbnail(img)
+
+    for quality in range(90, 30, -10):
+        buffer = io.BytesIO()
+        img.save(buffer, format=format, quality=quality, optimize=True)
+        if buffer.tell() <= max_bytes:
+            break
+
+    logger.info(f"Encoded thumbnail as {format}, {buffer.tell()} bytes")
+    buffer.seek(0)
+    return buffer
+
+
+def upload_image(img):
+    """Upload a file path or file-like object (e.g. an encoded thumbnail)."""
+    return cloudinary.uploader.upload(img)
 
 
 def get_table_by_id(table, record_id, api, base_id):
@@ -207,6 +304,27 @@ def get_table_by_id(table, record_id, api, base_id):
     return table.get(record_id)
 
 
+def get_records_by_ids(table, record_ids, api, base_id, page_size=100):
+    base = Base(api, base_id)
+    table = Table(None, base, table)
+
+    records = []
+    for i in range(0, len(record_ids), page_size):
+        ids = record_ids[i : i + page_size]
+        formula = "OR({})".format(
+            ",".join(f"RECORD_ID()='{escape_formula_string(id)}'" for id in ids)
+        )
+        records.extend(table.all(formula=formula, page_size=page_size))
+
+    # Never hand back more than was asked for
+    requested = set(record_ids)
+    return [record for record in records if record["id"] in requested]
+
+
+def escape_formula_string(value):
+    return str(value).replace("\\", "\\\\").replace("'", "\\'")
+
+
 def get_pdf_content(url):
     response = requests.get(url)
     pdf_file = PdfReader(io.BytesIO(response.content))
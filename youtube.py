@@ -1,8 +1,62 @@
+import os
+import json
+import threading
+from collections import OrderedDict
 from google_auth_oauthlib.flow import InstalledAppFlow
+from google.auth.transport.requests import Request
+from google.oauth2.credentials import Credentials
+from googleapiclient.discovery import build
+
+YOUTUBE_SCOPES = ["https://www.googleapis.com/auth/youtube.upload"]
+# Per-user YouTube clients kept by each thread
+YOUTUBE_CLIENT_POOL_SIZE = int(os.getenv("YOUTUBE_CLIENT_POOL_SIZE", 32))
 
 
 flow = InstalledAppFlow.from_client_secrets_file(
     "client_secret.json",
-    scopes=["https://www.googleapis.com/auth/youtube.upload"],
+    scopes=YOUTUBE_SCOPES,
     redirect_uri="https://endgn-e8584cd0220b.herokuapp.com/oauth2callback",
 )
+
+_local = threading.local()
+
+
+def get_youtube_client(user_record_id, token_json_str, on_refresh=None):
+    """
+    Return a YouTube client for a user's stored credentials.
+
+    Clients are reused per thread until the user's stored token changes. An
+    expired access token is refreshed up front and the new token JSON passed
+    to on_refresh, so it can be saved for the next client.
+    """
+    if getattr(_local, "pid", None) != os.getpid():
+        _local.clients = OrderedDict()
+        _local.pid = os.getpid()
+    clients = _local.clients
+
+    entry = clients.pop(user_record_id, None)
+    if entry is None or entry[0] != token_json_str:
+        credentials = Credentials.from_authorized_user_info(
+            json.loads(token_json_str), scopes=YOUTUBE_SCOPES
+        )
+        youtube = build(
+            "youtube",
+            "v3",
+            credentials=credentials,
+            cache_discovery=False,
+            static_discovery=True,
+        )
+        entry = (token_json_str, credentials, youtube)
+
+    _, credentials, youtube = entry
+    if not credentials.valid and credentials.refresh_token:
+        credentials.refresh(Request())
+        token_json_str = credentials.to_json()
+        if on_refresh:
+            on_refresh(token_json_str)
+        entry = (token_json_str, credentials, youtube)
+
+    clients[user_record_id] = entry
+    while len(clients) > YOUTUBE_CLIENT_POOL_SIZE:
+        clients.popitem(last=False)
+    return youtube